@@ -1,16 +1,45 @@
 import os
+import re
 import time
 import subprocess
 import argparse
 import getpass
+import functools
+import json
+import hashlib
+import shutil
+import shlex
+import contextlib
+import platform
 from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 import logging
-import urllib.parse
+from urllib.parse import urlparse, urlunparse, quote
 import threading
+import collections
+import itertools
+import mmap
+import statistics
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import git
 import fcntl
 from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import sync_flags
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # Not on Linux, or inotify_simple not installed
+    INotify = None
+
+try:
+    from watchdog.observers.inotify import InotifyObserver
+except ImportError:  # Not on Linux
+    InotifyObserver = None
 
 from Client_example import send_box, send_log, shutdown_server
 
@@ -18,67 +47,211 @@ from Client_example import send_box, send_log, shutdown_server
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
+def _detect_system_type():
+    """Detect the Linux distribution family once per process ("debian", "fedora" or "unknown")"""
+    try:
+        if os.path.exists("/etc/debian_version"):
+            return "debian"
+        elif os.path.exists("/etc/fedora-release") or os.path.exists("/etc/redhat-release"):
+            return "fedora"
+    except Exception:
+        pass
+    return "unknown"
+
 # Add this near the top of your script
-system_type = "unknown"
-try:
-    if os.path.exists("/etc/debian_version"):
-        system_type = "debian"
-    elif os.path.exists("/etc/fedora-release") or os.path.exists("/etc/redhat-release"):
-        system_type = "fedora"
-except Exception:
-    pass
+system_type = _detect_system_type()
 
+# Running as root (os.geteuid does not exist on Windows)
+_IS_ADMIN = getattr(os, 'geteuid', lambda: 1)() == 0
 
-def map_package_to_debian(package_name):
+# Per-project script that replays the install commands that worked last time
+INSTALL_SCRIPT = os.path.join(".agentic", "install_deps.sh")
+
+# On-disk cache for check_package_paths, invalidated when pdflatex changes
+PATHS_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "agentic_latex", "paths.json")
+
+# Package inclusion commands (\usepackage, \RequirePackage, \documentclass),
+# fused into one pattern so the source is scanned once per compile
+_PACKAGE_COMMAND_RE = re.compile(
+    r'\\(?P<command>usepackage|RequirePackage|documentclass)(?:\[.*?\])?\{(?P<names>[^}]+)\}'
+)
+
+# Missing-package patterns for extract_missing_packages: MiKTeX errors that
+# name the file on the next line, or any line naming a .sty file not found
+_STY_FILE_RE = re.compile(r'([\w@.-]+)\.sty\b')
+_MISSING_PACKAGE_RE = re.compile(
+    r'(?P<error_line>! Package \S+ Error: File.*not found.*)\n(?P<next_line>.*)'
+    r'|(?P<sty>[\w@.-]+)\.sty\b.*not found'
+)
+
+# Fallback patterns for extract_latex_errors when no "!" error lines were found
+_LATEX_FATAL_RE = re.compile(r'Emergency stop|Fatal error|No pages of output|Undefined control sequence|Missing ')
+_LATEX_WARN_LINE_RE = re.compile(r'^.*(?:warning|undefined|missing|error).*$', re.MULTILINE)
+
+# Fatal errors that mean pdflatex produced no usable PDF, shared by
+# validate_pdf_creation and the post-compile .log scan
+_FATAL_RE = re.compile(
+    r'Fatal error(?: occurred)?|Emergency stop|TeX capacity exceeded|no output PDF file produced',
+    re.IGNORECASE
+)
+# The same pattern for scanning mmapped .log files without decoding them
+_FATAL_RE_BYTES = re.compile(_FATAL_RE.pattern.encode('ascii'), re.IGNORECASE)
+
+# Packages a batched tlmgr install could not find, for per-package failure logging
+_TLMGR_MISSING_RE = re.compile(r'package (\S+) not present in repository')
+
+
+# Remote change checks fetch only master into a private prefetch ref: no tags,
+# no FETCH_HEAD, and no connectivity walk over alternates' refs
+PREFETCH_REF = "refs/prefetch/origin/master"
+PREFETCH_COMMAND = [
+    "git", "-c", "core.alternateRefsCommand=exit 0",
+    "fetch", "--no-tags", "--no-write-fetch-head", "--refmap=", "--prune",
+    "origin", f"+refs/heads/master:{PREFETCH_REF}"
+]
+
+# Merge the prefetched commits without going back to the network (git pull would
+# fetch them a second time), then move origin/master to match
+MERGE_PREFETCH_COMMAND = ["git", "merge", "--no-edit", PREFETCH_REF]
+UPDATE_TRACKING_COMMAND = ["git", "update-ref", "refs/remotes/origin/master", PREFETCH_REF]
+
+# strftime pattern for the stash taken before merging remote commits
+STASH_MESSAGE_FORMAT = "Auto-stash before pull at %Y-%m-%d %H:%M:%S"
+
+# Platform and Linux PDF viewer, looked up once: xdg-open if present, else the first installed fallback
+_SYSTEM = platform.system()
+_PDF_VIEWERS = ['xdg-open', 'evince', 'okular', 'atril', 'firefox', 'google-chrome']
+_PDF_VIEWER = next((viewer for viewer in _PDF_VIEWERS if shutil.which(viewer)), None)
+
+# Shared keep-alive session for the Overleaf API, so the endpoint fallbacks in
+# trigger_compilation reuse connections instead of a new TLS handshake each.
+# urllib3 does not retry POST by default; a repeated compile request is harmless, so allow it,
+# but only for the listed statuses: timeouts and connection errors are not retried, so a hung
+# endpoint still costs one 10 s timeout and a slow server never gets a duplicate request.
+# The last 5xx response is returned rather than raised so its status gets logged
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    max_retries=Retry(total=2, connect=0, read=0, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+))
+
+# Keep package managers from stopping at interactive prompts
+INSTALLER_ENV = {**os.environ, "DEBIAN_FRONTEND": "noninteractive", "APT_LISTCHANGES_FRONTEND": "none"}
+
+
+def run_streaming(cmd, timeout=None, tail_lines=4096):
     """
-    Maps LaTeX package names to Debian/Ubuntu package names
-    Returns a list of possible Debian package names for the given LaTeX package
-    """
-    # Common mappings for frequently used LaTeX packages to Debian/Ubuntu packages
-    debian_mappings = {
-        # Core packages
-        "xcolor": ["texlive-latex-recommended"],
-        "amsmath": ["texlive-latex-base"],
-        "amssymb": ["texlive-latex-recommended"],
-        "amsthm": ["texlive-latex-recommended"],
-        "geometry": ["texlive-latex-recommended"],
-        "graphicx": ["texlive-latex-recommended"],
-        "hyperref": ["texlive-latex-recommended"],
-        
-        # Extended packages
-        "tcolorbox": ["texlive-latex-extra"],
-        "framed": ["texlive-latex-extra"],
-        "etoolbox": ["texlive-latex-extra"],
-        "fancyhdr": ["texlive-latex-extra"],
-        "tikz": ["texlive-pictures"],
-        "pgf": ["texlive-pictures"],
-        "pstricks": ["texlive-pstricks"],
-        "biblatex": ["texlive-bibtex-extra"],
-        "beamer": ["texlive-latex-recommended"],
-        
-        # Font packages
-        "fontspec": ["texlive-fonts-extra"],
-        "lmodern": ["texlive-fonts-recommended"],
-        
-        # Math and science
-        "mathtools": ["texlive-science"],
-        "siunitx": ["texlive-science"],
-        "physics": ["texlive-science"],
-        "chemfig": ["texlive-science"],
-        
-        # Language and encoding
-        "babel": ["texlive-lang-all"],
-        "inputenc": ["texlive-latex-base"],
-        "fontenc": ["texlive-latex-base"],
-    }
+    Run an installer command, forwarding each output line to send_log as it arrives
+    Only the last tail_lines lines are kept; they are returned as both stdout
+    and stderr of a CompletedProcess (stderr is merged into stdout)
+    Raises subprocess.TimeoutExpired if the command runs longer than timeout
+    """
+    tail = collections.deque(maxlen=tail_lines)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, bufsize=1, env=INSTALLER_ENV)
+    
+    # Reading stdout blocks, so enforce the timeout by killing the process
+    timed_out = threading.Event()
+    def kill():
+        timed_out.set()
+        process.kill()
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    
+    try:
+        for line in process.stdout:
+            line = line.rstrip('\n')
+            tail.append(line)
+            send_log(line, level=0)
+        process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        process.stdout.close()
+    
+    output = "\n".join(tail)
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, output=output)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout=output, stderr=output)
+
+
+# Common mappings for frequently used LaTeX packages to Debian/Ubuntu packages
+DEBIAN_MAPPINGS = {
+    # Core packages
+    "xcolor": frozenset({"texlive-latex-recommended"}),
+    "amsmath": frozenset({"texlive-latex-base"}),
+    "amssymb": frozenset({"texlive-latex-recommended"}),
+    "amsthm": frozenset({"texlive-latex-recommended"}),
+    "geometry": frozenset({"texlive-latex-recommended"}),
+    "graphicx": frozenset({"texlive-latex-recommended"}),
+    "hyperref": frozenset({"texlive-latex-recommended"}),
+    
+    # Extended packages
+    "tcolorbox": frozenset({"texlive-latex-extra"}),
+    "framed": frozenset({"texlive-latex-extra"}),
+    "etoolbox": frozenset({"texlive-latex-extra"}),
+    "fancyhdr": frozenset({"texlive-latex-extra"}),
+    "tikz": frozenset({"texlive-pictures"}),
+    "pgf": frozenset({"texlive-pictures"}),
+    "pstricks": frozenset({"texlive-pstricks"}),
+    "biblatex": frozenset({"texlive-bibtex-extra"}),
+    "beamer": frozenset({"texlive-latex-recommended"}),
+    
+    # Font packages
+    "fontspec": frozenset({"texlive-fonts-extra"}),
+    "lmodern": frozenset({"texlive-fonts-recommended"}),
     
-    # Check if we have a direct mapping
-    if package_name in debian_mappings:
-        return debian_mappings[package_name]
+    # Math and science
+    "mathtools": frozenset({"texlive-science"}),
+    "siunitx": frozenset({"texlive-science"}),
+    "physics": frozenset({"texlive-science"}),
+    "chemfig": frozenset({"texlive-science"}),
     
-    # For packages not in our mapping, suggest likely collections
-    # Most packages are in texlive-latex-extra
-    return ["texlive-latex-extra", "texlive-latex-recommended"]
+    # Language and encoding
+    "babel": frozenset({"texlive-lang-all"}),
+    "inputenc": frozenset({"texlive-latex-base"}),
+    "fontenc": frozenset({"texlive-latex-base"}),
+}
+
+# For packages not in our mapping, suggest likely collections
+# Most packages are in texlive-latex-extra
+_DEFAULT_DEBIAN = frozenset({"texlive-latex-extra", "texlive-latex-recommended"})
+
+
+def map_package_to_debian(package_name):
+    """
+    Maps LaTeX package names to Debian/Ubuntu package names
+    Returns a frozenset of possible Debian package names for the given LaTeX package
+    """
+    return DEBIAN_MAPPINGS.get(package_name, _DEFAULT_DEBIAN)
+
+def probe_installed(package_name):
+    """Check with dpkg-query whether a Debian package is installed"""
+    try:
+        result = subprocess.run(
+            ["dpkg-query", "-W", "-f=${Status}", package_name],
+            capture_output=True,
+            text=True,
+            check=False
+        )
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0 and result.stdout.strip() == "install ok installed"
+
+def probe_installed_packages(package_names, max_workers=8):
+    """
+    Run probe_installed for several Debian packages in parallel
+    The probes are read-only, so they can overlap; only installs need to be serialized
+    Returns a dict of {package_name: installed}
+    """
+    package_names = list(package_names)
+    if not package_names:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(package_names, executor.map(probe_installed, package_names)))
 
 def try_debian_package_installation(packages):
     """
@@ -87,21 +260,30 @@ def try_debian_package_installation(packages):
     """
     logger.info("Attempting to install LaTeX packages using apt-get...")
     
-    # Step 1: Try mapping each package to Debian packages
-    all_debian_packages = set()
-    for pkg in packages:
-        debian_pkgs = map_package_to_debian(pkg)
-        all_debian_packages.update(debian_pkgs)
-    
-    # Remove duplicates and convert to list
+    # Step 1: Try mapping each package to Debian packages (the union removes duplicates)
+    all_debian_packages = set().union(*map(map_package_to_debian, packages))
     debian_packages_list = list(all_debian_packages)
     logger.info(f"Mapped LaTeX packages to Debian packages: {', '.join(debian_packages_list)}")
     
+    # Common metapackages that cover most LaTeX needs (used in step 3)
+    metapackages = [
+        "texlive-latex-recommended",
+        "texlive-latex-extra",
+        "texlive-fonts-recommended",
+        "texlive-science"
+    ]
+    
+    # Check up front which candidates are already installed, so no-op apt-get runs can be skipped
+    installed = probe_installed_packages(all_debian_packages | set(metapackages) | {"texlive-full"})
+    
     # Step 2: Try installing the mapped packages
+    if all(installed[pkg] for pkg in debian_packages_list):
+        logger.info("Mapped Debian packages are already installed")
+        return True
     try:
-        cmd = ["sudo", "apt-get", "install", "-y"] + debian_packages_list
+        cmd = ["sudo", "apt-get", "-q", "-q", "install", "-y"] + debian_packages_list
         logger.info(f"Running: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=300)
+        result = run_streaming(cmd, timeout=300)
         
         if result.returncode == 0:
             logger.info("Successfully installed LaTeX packages using apt-get")
@@ -112,17 +294,13 @@ def try_debian_package_installation(packages):
         logger.warning(f"Error installing mapped packages: {str(e)}")
     
     # Step 3: Try common metapackages that cover most LaTeX needs
-    metapackages = [
-        "texlive-latex-recommended",
-        "texlive-latex-extra",
-        "texlive-fonts-recommended",
-        "texlive-science"
-    ]
-    
+    if all(installed[pkg] for pkg in metapackages):
+        logger.info("LaTeX metapackages are already installed")
+        return True
     try:
-        cmd = ["sudo", "apt-get", "install", "-y"] + metapackages
+        cmd = ["sudo", "apt-get", "-q", "-q", "install", "-y"] + metapackages
         logger.info(f"Trying metapackages: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=300)
+        result = run_streaming(cmd, timeout=300)
         
         if result.returncode == 0:
             logger.info("Successfully installed LaTeX metapackages")
@@ -133,10 +311,13 @@ def try_debian_package_installation(packages):
         logger.warning(f"Error installing metapackages: {str(e)}")
     
     # Step 4: Last resort - try texlive-full
+    if installed["texlive-full"]:
+        logger.info("texlive-full is already installed")
+        return True
     try:
         logger.info("Trying texlive-full as a last resort (large but comprehensive)...")
-        cmd = ["sudo", "apt-get", "install", "-y", "texlive-full"]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=600)
+        cmd = ["sudo", "apt-get", "-q", "-q", "install", "-y", "texlive-full"]
+        result = run_streaming(cmd, timeout=600)
         
         if result.returncode == 0:
             logger.info("Successfully installed texlive-full")
@@ -149,23 +330,41 @@ def try_debian_package_installation(packages):
     return False
 
 
-def extract_latex_errors(log_output):
+def _line_context(text, pos, before=3, after=3):
     """
-    Extract more detailed error information from LaTeX output
-    Returns a list of error messages
+    Return the line containing pos plus a few lines either side,
+    located with rfind/find instead of splitting the whole text
     """
-    errors = []
-    lines = log_output.split('\n')
+    start = text.rfind('\n', 0, pos) + 1
+    for _ in range(before):
+        if start == 0:
+            break
+        start = text.rfind('\n', 0, start - 1) + 1
+    
+    end = pos
+    for _ in range(after + 1):
+        end = text.find('\n', end)
+        if end == -1:
+            end = len(text)
+            break
+        end += 1
     
+    return text[start:end].rstrip('\n')
+
+def _iter_error_blocks(lines):
+    """
+    Yield the "!" error blocks (error line plus its context lines) found in
+    an iterable of log lines, as soon as each block is complete
+    """
     # Flag to track if we're in an error section
     in_error = False
     current_error = ""
     
-    for i, line in enumerate(lines):
+    for line in lines:
         # Check for common error markers
         if line.startswith('!') or ('! ' in line and not line.startswith(' ')):
-            if in_error and current_error:  # Save previous error if it exists
-                errors.append(current_error.strip())
+            if in_error and current_error:  # Yield previous error if it exists
+                yield current_error.strip()
             
             in_error = True
             current_error = line
@@ -179,95 +378,172 @@ def extract_latex_errors(log_output):
             if 'erro' not in line.lower() and 'warn' not in line.lower() and line.strip() == '':
                 in_error = False
                 if current_error:
-                    errors.append(current_error.strip())
+                    yield current_error.strip()
                 current_error = ""
     
     # Add the last error if we were still in an error section
     if in_error and current_error:
-        errors.append(current_error.strip())
+        yield current_error.strip()
+
+def extract_latex_errors(log_output):
+    """
+    Extract more detailed error information from LaTeX output
+    Returns a list of error messages
+    """
+    errors = list(_iter_error_blocks(log_output.splitlines()))
     
     # Look for specific patterns in the log if no errors were found
     if not errors:
-        for line in lines:
-            for error_pattern in [
-                "Emergency stop", 
-                "Fatal error", 
-                "No pages of output",
-                "Undefined control sequence",
-                "Missing "
-            ]:
-                if error_pattern in line:
-                    # Get a few lines of context
-                    context_index = lines.index(line)
-                    context_start = max(0, context_index - 3)
-                    context_end = min(len(lines), context_index + 4)
-                    context = "\n".join(lines[context_start:context_end])
-                    errors.append(context)
-                    break
+        last_line_start = -1
+        for match in _LATEX_FATAL_RE.finditer(log_output):
+            # Only report each line once, even if it matches several patterns
+            line_start = log_output.rfind('\n', 0, match.start()) + 1
+            if line_start == last_line_start:
+                continue
+            last_line_start = line_start
+            # Get a few lines of context
+            errors.append(_line_context(log_output, match.start()))
     
     # Add compilation info from log if we still have no errors
     if not errors:
         # Look for any warnings or issues
-        for line in lines:
-            if any(pattern in line for pattern in [
-                "warning", "undefined", "missing", "error"
-            ]):
-                errors.append(line.strip())
+        errors.extend(line.strip() for line in _LATEX_WARN_LINE_RE.findall(log_output))
     
     return errors
 
+def read_log_errors(log_path, max_errors=3):
+    """
+    Return up to max_errors errors from a LaTeX .log file
+    The file is streamed line by line and reading stops once enough "!" errors
+    are found; only logs without any fall back to extract_latex_errors
+    """
+    try:
+        with open(log_path, 'r', encoding='latin-1', errors='replace') as f:
+            errors = list(itertools.islice(_iter_error_blocks(line.rstrip('\n') for line in f), max_errors))
+            if errors:
+                return errors
+            f.seek(0)
+            return extract_latex_errors(f.read())[:max_errors]
+    except FileNotFoundError:
+        return []
+
+def search_log_file(log_path, pattern):
+    """
+    Search a log file with a bytes pattern through a read-only mmap, so the
+    file is neither copied into memory nor decoded
+    Returns the matched text, or None if there is no match or no log file
+    """
+    try:
+        with open(log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            match = pattern.search(mm)
+            return match.group(0).decode('latin-1') if match else None
+    except FileNotFoundError:
+        return None
+    except ValueError:  # Empty files cannot be mapped
+        return None
+
+def _try_stat(path):
+    """os.stat(path), or None if the path does not exist or cannot be read"""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def _pdflatex_mtime():
+    """Modification time of the pdflatex binary, or None if it is not installed"""
+    pdflatex = shutil.which("pdflatex")
+    stat = _try_stat(pdflatex) if pdflatex else None
+    return stat.st_mtime if stat else None
+
+def kpsewhich_files(filenames):
+    """
+    Look up several files with one kpsewhich invocation
+    kpsewhich prints one path per file it finds and nothing for missing
+    files, so results are matched back by basename
+    Returns a dict of {filename: path} for the files that were found
+    """
+    if not filenames:
+        return {}
+    result = subprocess.run(
+        ["kpsewhich", *filenames],
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    wanted = set(filenames)
+    found = {}
+    for line in result.stdout.splitlines():
+        path = line.strip()
+        name = os.path.basename(path)
+        if name in wanted and name not in found:
+            found[name] = path
+    return found
+
+def kpsewhich_vars(names):
+    """
+    Expand several kpathsea variables with one kpsewhich invocation
+    Returns a list of values in the same order as names ("" if unset)
+    """
+    result = subprocess.run(
+        ["kpsewhich", "-expand-var=" + "\n".join(f"${name}" for name in names)],
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    values = [line.strip() for line in result.stdout.splitlines()]
+    values += [""] * (len(names) - len(values))
+    return values[:len(names)]
+
 def check_package_paths():
     """
     Check if LaTeX can find the installed packages
+    Results are cached in memory and in PATHS_CACHE_FILE until pdflatex changes
     Returns a tuple of (status, paths)
     """
+    pdflatex_mtime = _pdflatex_mtime()
+    
+    # Reuse the result from a previous run if the TeX installation is unchanged
+    if pdflatex_mtime is not None:
+        try:
+            with open(PATHS_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("pdflatex_mtime") == pdflatex_mtime:
+                return (cached["status"], cached["paths"])
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    status, paths_info = _probe_package_paths()
+    
+    if pdflatex_mtime is not None and "error" not in paths_info:
+        try:
+            os.makedirs(os.path.dirname(PATHS_CACHE_FILE), exist_ok=True)
+            with open(PATHS_CACHE_FILE, 'w', encoding='utf-8') as f:
+                json.dump({"pdflatex_mtime": pdflatex_mtime, "status": status, "paths": paths_info}, f)
+        except OSError as e:
+            logger.debug(f"Could not write paths cache: {str(e)}")
+    
+    return (status, paths_info)
+
+def invalidate_tex_caches():
+    """Forget cached path probes and the .sty index after the TeX tree has changed"""
+    _probe_package_paths.cache_clear()
+    texmf_sty_index.cache_clear()
     try:
-        # Run kpsewhich to check LaTeX paths
-        result = subprocess.run(
-            ["kpsewhich", "-var-value=TEXMFHOME"], 
-            capture_output=True, 
-            text=True, 
-            check=False
-        )
-        
-        texmf_home = result.stdout.strip()
-        
-        # Get system paths
-        result = subprocess.run(
-            ["kpsewhich", "-var-value=TEXMFDIST"], 
-            capture_output=True, 
-            text=True, 
-            check=False
-        )
-        
-        texmf_dist = result.stdout.strip()
+        os.remove(PATHS_CACHE_FILE)
+    except OSError:
+        pass
+
+@functools.lru_cache(maxsize=1)
+def _probe_package_paths():
+    """Run the kpsewhich probes behind check_package_paths"""
+    try:
+        # Expand all three variables with a single kpsewhich call
+        texmf_home, texmf_dist, texmf_var = kpsewhich_vars(["TEXMFHOME", "TEXMFDIST", "TEXMFVAR"])
         
         # Check for specific packages to confirm they're findable
         test_packages = ["xcolor.sty", "amsmath.sty", "geometry.sty"]
-        package_paths = {}
-        
-        for pkg in test_packages:
-            result = subprocess.run(
-                ["kpsewhich", pkg], 
-                capture_output=True, 
-                text=True, 
-                check=False
-            )
-            
-            if result.stdout.strip():
-                package_paths[pkg] = result.stdout.strip()
-            else:
-                package_paths[pkg] = "Not found"
-        
-        # Check if TeX Live is using correct TEXMFVAR
-        result = subprocess.run(
-            ["kpsewhich", "-var-value=TEXMFVAR"], 
-            capture_output=True, 
-            text=True, 
-            check=False
-        )
-        
-        texmf_var = result.stdout.strip()
+        found = kpsewhich_files(test_packages)
+        package_paths = {pkg: found.get(pkg, "Not found") for pkg in test_packages}
         
         # Get TeX format information
         result = subprocess.run(
@@ -289,7 +565,7 @@ def check_package_paths():
         
         # Check if paths exist
         for path_name, path in [("TEXMFHOME", texmf_home), ("TEXMFDIST", texmf_dist), ("TEXMFVAR", texmf_var)]:
-            if path and os.path.exists(path):
+            if path and _try_stat(path) is not None:
                 paths_info[f"{path_name} exists"] = "Yes"
             else:
                 paths_info[f"{path_name} exists"] = "No"
@@ -312,15 +588,13 @@ def fix_texlive_paths():
         # Check current user's home directory
         home_dir = os.path.expanduser("~")
         
-        # Check if texmf directory exists in home
+        # Check for texture directory; if it exists, the texmf directory does too
         texmf_home = os.path.join(home_dir, "texmf")
-        if not os.path.exists(texmf_home):
-            os.makedirs(texmf_home, exist_ok=True)
-            logger.info(f"Created TEXMFHOME directory at {texmf_home}")
-        
-        # Check for texture directory
         texture_dir = os.path.join(texmf_home, "tex", "latex")
-        if not os.path.exists(texture_dir):
+        if _try_stat(texture_dir) is None:
+            # Check if texmf directory exists in home
+            if _try_stat(texmf_home) is None:
+                logger.info(f"Creating TEXMFHOME directory at {texmf_home}")
             os.makedirs(texture_dir, exist_ok=True)
             logger.info(f"Created LaTeX directory at {texture_dir}")
         
@@ -331,7 +605,8 @@ def fix_texlive_paths():
         
         # Refresh TeX file database
         try:
-            subprocess.run(["mktexlsr"], check=False, capture_output=True)
+            subprocess.run(["mktexlsr"], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            invalidate_tex_caches()
             logger.info("Refreshed TeX file database with mktexlsr")
         except:
             logger.info("Could not refresh TeX file database")
@@ -355,6 +630,24 @@ def fix_texlive_paths():
         logger.error(f"Error fixing TeX Live paths: {str(e)}")
         return False
 
+# System directories searched for packages kpsewhich cannot see
+TEXMF_SYSTEM_DIRS = ["/usr/share/texlive/texmf-dist", "/usr/share/texmf", "/usr/local/texlive"]
+
+@functools.lru_cache(maxsize=1)
+def texmf_sty_index():
+    """
+    Walk the system texmf directories once and index every .sty file
+    Returns a dict of {filename: full path}, keeping the first match
+    Cleared by invalidate_tex_caches() after package installs
+    """
+    index = {}
+    for texmf_dir in [d for d in TEXMF_SYSTEM_DIRS if _try_stat(d) is not None]:
+        for dirpath, _, filenames in os.walk(texmf_dir):
+            for filename in filenames:
+                if filename.endswith('.sty'):
+                    index.setdefault(filename, os.path.join(dirpath, filename))
+    return index
+
 def verify_package_installation(packages):
     """
     Verify that packages are actually installed and accessible to LaTeX
@@ -364,22 +657,17 @@ def verify_package_installation(packages):
     all_found = True
     
     try:
+        # Use a single kpsewhich call to check which packages LaTeX can find
+        found = kpsewhich_files([f"{pkg}.sty" for pkg in packages])
+        
         for pkg in packages:
             pkg_file = f"{pkg}.sty"
             
-            # Use kpsewhich to check if LaTeX can find the package
-            result = subprocess.run(
-                ["kpsewhich", pkg_file],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            
-            if result.stdout.strip():
+            if pkg_file in found:
                 # Package found
                 results[pkg] = {
                     "found": True,
-                    "path": result.stdout.strip()
+                    "path": found[pkg_file]
                 }
             else:
                 # Package not found
@@ -390,20 +678,9 @@ def verify_package_installation(packages):
                 }
                 
                 # Try to find package in system directories
-                for texmf_dir in ["/usr/share/texlive/texmf-dist", "/usr/share/texmf", "/usr/local/texlive"]:
-                    if os.path.exists(texmf_dir):
-                        # Use find to locate the package
-                        find_cmd = ["find", texmf_dir, "-name", pkg_file]
-                        find_result = subprocess.run(
-                            find_cmd,
-                            capture_output=True,
-                            text=True,
-                            check=False
-                        )
-                        
-                        if find_result.stdout.strip():
-                            results[pkg]["system_path"] = find_result.stdout.strip()
-                            break
+                system_path = texmf_sty_index().get(pkg_file)
+                if system_path:
+                    results[pkg]["system_path"] = system_path
         
         return (all_found, results)
     
@@ -435,59 +712,25 @@ def verify_package_installation(packages):
 def extract_missing_packages(log_output):
     """
     Extract missing package names from LaTeX log output
-    Enhanced to detect packages with different error patterns
-    """
-    missing_packages = []
-    lines = log_output.split('\n')
-    
-    for i, line in enumerate(lines):
-        # Pattern 1: The standard error message for missing packages
-        if "! LaTeX Error: File" in line and "not found" in line:
-            # Extract the package name (usually in the format 'package.sty')
-            parts = line.split("'")
-            if len(parts) >= 2:
-                package_file = parts[1]
-                # Remove file extension (.sty) to get package name
-                if package_file.endswith('.sty'):
-                    package_name = package_file[:-4]  # Remove '.sty'
-                    missing_packages.append(package_name)
-        
-        # Pattern 2: Another common error format
-        elif "! LaTeX Error: File `" in line and ".sty' not found" in line:
-            # Extract between backtick and .sty
-            try:
-                package_file = line.split('`')[1].split("'")[0]
-                if package_file.endswith('.sty'):
-                    package_name = package_file[:-4]
-                    missing_packages.append(package_name)
-            except (IndexError, KeyError):
-                continue
-        
-        # Pattern 3: MikTeX specific errors
-        elif "! Package " in line and "Error: File" in line and "not found" in line:
-            try:
-                # Try to get the next line for more info
-                next_line = lines[i+1] if i+1 < len(lines) else ""
-                if '.sty' in next_line:
-                    # Look for .sty file in the next line
-                    for word in next_line.split():
-                        if word.endswith('.sty'):
-                            package_name = word[:-4]
-                            missing_packages.append(package_name)
-            except (IndexError, KeyError):
-                continue
-        
-        # Pattern 4: Simple pattern matching for any line containing both .sty and not found
-        elif ".sty" in line and "not found" in line:
-            for word in line.split():
-                if word.endswith('.sty') or word.endswith('.sty.'):
-                    # Clean up the word to get just the package name
-                    package_name = word.rstrip('.,').strip()[:-4]
-                    if package_name and package_name not in missing_packages:
-                        missing_packages.append(package_name)
+    Detects "File `pkg.sty' not found" in its LaTeX and MiKTeX forms,
+    including MiKTeX errors that name the file on the following line
+    """
+    # Every pattern below requires "not found", so most logs can be skipped outright
+    if "not found" not in log_output:
+        return []
     
-    # Remove duplicates and return
-    return list(set(missing_packages))
+    missing_packages = set()
+    
+    for match in _MISSING_PACKAGE_RE.finditer(log_output):
+        if match.group('sty'):
+            # Any line naming a .sty file that was not found (LaTeX and MiKTeX formats)
+            missing_packages.add(match.group('sty'))
+        else:
+            # MiKTeX specific errors name the file on the next line
+            missing_packages.update(_STY_FILE_RE.findall(match.group('error_line')))
+            missing_packages.update(_STY_FILE_RE.findall(match.group('next_line')))
+    
+    return list(missing_packages)
 
 def extract_packages_from_source(content):
     """
@@ -495,27 +738,17 @@ def extract_packages_from_source(content):
     Enhanced to detect more package inclusion patterns
     """
     packages = []
+    doc_class = None
     
-    # Look for various package commands
-    import re
-    
-    # Pattern 1: Standard \usepackage commands
-    # Match both \usepackage{pkg} and \usepackage[options]{pkg}
-    pattern1 = r'\\usepackage(?:\[.*?\])?\{([^}]+)\}'
-    matches1 = re.findall(pattern1, content)
-    
-    # Pattern 2: RequirePackage commands 
-    # Often used in class and style files
-    pattern2 = r'\\RequirePackage(?:\[.*?\])?\{([^}]+)\}'
-    matches2 = re.findall(pattern2, content)
-    
-    # Combine all matches
-    all_matches = matches1 + matches2
-    
-    for match in all_matches:
-        # Some package commands include multiple packages separated by commas
-        pkgs = [pkg.strip() for pkg in match.split(',')]
-        packages.extend(pkgs)
+    # Single pass over the source for \usepackage, \RequirePackage (often used
+    # in class and style files) and \documentclass, each with optional [options]
+    for match in _PACKAGE_COMMAND_RE.finditer(content):
+        if match.group('command') == 'documentclass':
+            if doc_class is None:
+                doc_class = match.group('names').strip()
+        else:
+            # Some package commands include multiple packages separated by commas
+            packages.extend(pkg.strip() for pkg in match.group('names').split(','))
     
     # Add some common dependencies that might not be explicitly mentioned
     # For example, if tikz is used, pgf is needed
@@ -529,53 +762,133 @@ def extract_packages_from_source(content):
         packages.append('xcolor')  # tcolorbox requires xcolor
         
     # Document class detection - some document classes need specific packages
-    class_pattern = r'\\documentclass(?:\[.*?\])?\{([^}]+)\}'
-    class_matches = re.findall(class_pattern, content)
-    if class_matches:
-        doc_class = class_matches[0].strip()
-        if doc_class == 'beamer' and 'xcolor' not in packages:
-            packages.append('xcolor')  # beamer needs xcolor
+    if doc_class == 'beamer' and 'xcolor' not in packages:
+        packages.append('xcolor')  # beamer needs xcolor
     
     # Remove duplicates and return
     return list(set(packages))
 
-def install_latex_packages(packages):
+# Recent extraction results keyed by content digest, most recently used last
+_PACKAGE_CACHE_SIZE = 8
+_package_cache = collections.OrderedDict()
+_package_cache_lock = threading.Lock()
+
+def packages_for_content(content):
+    """
+    extract_packages_from_source, memoized per content digest so repeated
+    compiles of the same source skip the scan
+    """
+    key = hashlib.blake2b(content.encode('utf-8', 'replace'), digest_size=16).digest()
+    with _package_cache_lock:
+        if key in _package_cache:
+            _package_cache.move_to_end(key)
+            return list(_package_cache[key])
+    
+    packages = extract_packages_from_source(content)
+    with _package_cache_lock:
+        _package_cache[key] = tuple(packages)
+        if len(_package_cache) > _PACKAGE_CACHE_SIZE:
+            _package_cache.popitem(last=False)
+    return packages
+
+def _package_set_hash(packages):
+    """Stable hash of a package set, used to key generated install scripts"""
+    return hashlib.sha1(json.dumps(sorted(set(packages))).encode('utf-8')).hexdigest()
+
+def _install_script_path(project_dir):
+    return os.path.join(project_dir, INSTALL_SCRIPT)
+
+def run_install_script(project_dir, packages):
+    """
+    Replay the install script generated for this project, if it was
+    generated for the same package set
+    Returns True if the script exists, matches and ran successfully
+    """
+    script = _install_script_path(project_dir)
+    try:
+        with open(script, 'r', encoding='utf-8') as f:
+            f.readline()  # shebang
+            header = f.readline()
+    except OSError:
+        return False
+    
+    if not header.startswith(f"# generated for {_package_set_hash(packages)} "):
+        return False
+    
+    logger.info(f"Package set unchanged, replaying {script}")
+    try:
+        result = run_streaming(["bash", script], timeout=600)
+        return result.returncode == 0
+    except Exception as e:
+        logger.warning(f"Error running install script: {str(e)}")
+        return False
+
+def write_install_script(project_dir, packages, commands):
+    """
+    Save the commands that installed this package set as a bash script,
+    so later runs can skip detection and mapping (see run_install_script)
+    """
+    script = _install_script_path(project_dir)
+    try:
+        os.makedirs(os.path.dirname(script), exist_ok=True)
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write("#!/bin/bash\n")
+            f.write(f"# generated for {_package_set_hash(packages)} on {_detect_system_type()}\n")
+            f.write("set -e\n")
+            for cmd in commands:
+                f.write(shlex.join(cmd) + "\n")
+        logger.info(f"Saved package installation commands to {script}")
+    except OSError as e:
+        logger.warning(f"Could not write install script: {str(e)}")
+
+def install_latex_packages(packages, project_dir=None):
     """
     Attempt to install missing LaTeX packages using the appropriate package manager
+    If project_dir is given, the successful commands are saved to a script in
+    project_dir and replayed directly while the package set stays the same
     Returns True if installation was successful, False otherwise
     """
     if not packages:
         return False
     
+    if project_dir and run_install_script(project_dir, packages):
+        return True
+    
     logger.info(f"Attempting to install LaTeX packages: {', '.join(packages)}")
     
     # Detect the LaTeX distribution
     latex_system = detect_latex_system()
+    commands = []
     
     if latex_system == "texlive":
-        return install_texlive_packages(packages)
+        success = install_texlive_packages(packages, commands)
     elif latex_system == "miktex":
-        return install_miktex_packages(packages)
+        success = install_miktex_packages(packages, commands)
     else:
         logger.warning(f"Unsupported LaTeX distribution or couldn't detect the distribution.")
         logger.info(f"Please install these packages manually: {', '.join(packages)}")
         return False
+    
+    if success and project_dir:
+        write_install_script(project_dir, packages, commands)
+    return success
 
+@functools.lru_cache(maxsize=1)
 def detect_latex_system():
-    """Detect which LaTeX distribution is installed"""
+    """Detect which LaTeX distribution is installed (cached for the process lifetime)"""
     try:
         # Check for TeX Live
         result = subprocess.run(["tlmgr", "--version"], 
-                              capture_output=True, 
-                              text=True, 
+                              stdout=subprocess.DEVNULL, 
+                              stderr=subprocess.DEVNULL, 
                               check=False)
         if result.returncode == 0:
             return "texlive"
         
         # Check for MiKTeX
         result = subprocess.run(["mpm", "--version"], 
-                              capture_output=True, 
-                              text=True, 
+                              stdout=subprocess.DEVNULL, 
+                              stderr=subprocess.DEVNULL, 
                               check=False)
         if result.returncode == 0:
             return "miktex"
@@ -586,27 +899,122 @@ def detect_latex_system():
     # If we reach here, couldn't determine the system
     return "unknown"
 
-def install_texlive_packages(packages):
-    """Install packages using TeX Live's tlmgr or system package manager"""
+@functools.lru_cache(maxsize=1)
+def has_admin_privileges():
+    """True if running as root or sudo works without a password prompt (checked once per process)"""
+    if _IS_ADMIN:
+        return True
+    try:
+        # Check if sudo is available without password prompt
+        subprocess.run(["sudo", "-n", "true"], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+# Package installation methods, built once per process. Each command_creator
+# takes the full package list; the system package methods install fixed
+# meta-packages and ignore it
+
+def _apt_install(*apt_packages):
+    return lambda packages: ["sudo", "apt-get", "-q", "-q", "install", "-y", *apt_packages]
+
+def _dnf_install(*dnf_packages):
+    return lambda packages: ["sudo", "dnf", "install", "-y", *dnf_packages]
+
+def _tlmgr_install(packages):
+    return ["tlmgr", "install", *packages]
+
+def _tlmgr_usermode_install(packages):
+    return ["tlmgr", "--usermode", "install", *packages]
+
+def _sudo_tlmgr_install(packages):
+    return ["sudo", "tlmgr", "install", *packages]
+
+# Ubuntu/Debian package naming variations - these are the common patterns
+_DEBIAN_PACKAGE_PREFIXES = [
+    "texlive-latex-recommended",  # Common packages
+    "texlive-latex-extra",        # Extra packages
+    "texlive-fonts-recommended",  # Font packages
+    "texlive-science",            # Scientific packages
+    "texlive-plain-generic"       # Generic TeX packages
+]
+
+_SYSTEM_INSTALL_METHODS = {
+    # For Debian/Ubuntu systems
+    "debian": [
+        {
+            "description": f"apt-get with {prefix}",
+            "command_creator": _apt_install(prefix),
+            "requires_admin": True,
+            "bulk_install": True,  # Installs a fixed meta-package
+            "apt_packages": [prefix]
+        }
+        for prefix in _DEBIAN_PACKAGE_PREFIXES
+    ] + [
+        # Try installing texlive-full as a last resort (large but comprehensive)
+        {
+            "description": "apt-get texlive-full (complete TeX Live)",
+            "command_creator": _apt_install("texlive-full"),
+            "requires_admin": True,
+            "bulk_install": True,
+            "priority": -1,  # Very large download, only when everything else failed
+            "apt_packages": ["texlive-full"]
+        }
+    ],
+    # For Fedora/RHEL systems
+    "fedora": [
+        {
+            "description": "dnf with texlive-scheme-medium",
+            "command_creator": _dnf_install("texlive-scheme-medium"),
+            "requires_admin": True,
+            "bulk_install": True
+        },
+        {
+            "description": "dnf with texlive-collection-latexextra",
+            "command_creator": _dnf_install("texlive-collection-latexextra"),
+            "requires_admin": True,
+            "bulk_install": True
+        }
+    ]
+}
+
+_TLMGR_INSTALL_METHODS = [
+    # Standard tlmgr install
+    {"description": "Standard tlmgr install", "command_creator": _tlmgr_install},
+    # User mode
+    {"description": "User mode", "command_creator": _tlmgr_usermode_install},
+    # Sudo
+    {"description": "Sudo with tlmgr", "command_creator": _sudo_tlmgr_install, "requires_admin": True}
+]
+
+# Used once an outdated TeX Live has been updated
+_TLMGR_UPDATED_INSTALL_METHODS = [
+    {"description": "Standard tlmgr install (after update)", "command_creator": _tlmgr_install},
+    {"description": "User mode (after update)", "command_creator": _tlmgr_usermode_install}
+]
+
+def install_texlive_packages(packages, installed_commands=None):
+    """
+    Install packages using TeX Live's tlmgr or system package manager
+    Each method installs the whole package list with a single command
+    The commands of the method that succeeded are appended to installed_commands if given
+    """
     try:
         # Detect the system type
-        system_type = "unknown"
-        try:
-            if os.path.exists("/etc/debian_version"):
-                system_type = "debian"
-                logger.info("Detected Debian/Ubuntu system")
-            elif os.path.exists("/etc/fedora-release") or os.path.exists("/etc/redhat-release"):
-                system_type = "fedora"
-                logger.info("Detected Fedora/RHEL system")
-        except Exception:
-            pass
+        system_type = _detect_system_type()
+        if system_type == "debian":
+            logger.info("Detected Debian/Ubuntu system")
+        elif system_type == "fedora":
+            logger.info("Detected Fedora/RHEL system")
         
         # Check TeX Live version and repository status
         texlive_outdated = False
         try:
             version_check = subprocess.run(
                 ["tlmgr", "repository", "list"], 
-                capture_output=True, 
+                stdout=subprocess.DEVNULL, 
+                stderr=subprocess.PIPE, 
                 text=True, 
                 check=False
             )
@@ -620,92 +1028,24 @@ def install_texlive_packages(packages):
         if texlive_outdated:
             logger.info("Will prioritize system package manager due to outdated TeX Live")
         
-        # Create a mapping of package installation methods for different scenarios
-        installation_methods = []
-        
-        # For Debian/Ubuntu systems
-        if system_type == "debian":
-            # Ubuntu/Debian package naming variations - these are the common patterns
-            debian_package_prefixes = [
-                "texlive-latex-recommended",  # Common packages
-                "texlive-latex-extra",        # Extra packages
-                "texlive-fonts-recommended",  # Font packages
-                "texlive-science",            # Scientific packages
-                "texlive-plain-generic"       # Generic TeX packages
-            ]
-            
-            for prefix in debian_package_prefixes:
-                installation_methods.append({
-                    "description": f"apt-get with {prefix}",
-                    "command_creator": lambda _: ["sudo", "apt-get", "install", "-y"] + 
-                                               [prefix],
-                    "requires_admin": True,
-                    "bulk_install": True  # Install all packages at once
-                })
-            
-            # Try installing texlive-full as a last resort (large but comprehensive)
-            installation_methods.append({
-                "description": "apt-get texlive-full (complete TeX Live)",
-                "command_creator": lambda _: ["sudo", "apt-get", "install", "-y", "texlive-full"],
-                "requires_admin": True,
-                "bulk_install": True
-            })
-        
-        # For Fedora/RHEL systems
-        elif system_type == "fedora":
-            installation_methods.append({
-                "description": "dnf with texlive-scheme-medium",
-                "command_creator": lambda _: ["sudo", "dnf", "install", "-y", "texlive-scheme-medium"],
-                "requires_admin": True,
-                "bulk_install": True
-            })
-            
-            installation_methods.append({
-                "description": "dnf with texlive-collection-latexextra",
-                "command_creator": lambda _: ["sudo", "dnf", "install", "-y", "texlive-collection-latexextra"],
-                "requires_admin": True,
-                "bulk_install": True
-            })
+        # Start from the precomputed methods for this system (copied, the list is sorted below)
+        installation_methods = list(_SYSTEM_INSTALL_METHODS.get(system_type, []))
         
         # Add TeX Live methods (if not outdated, or as fallback)
         if not texlive_outdated:
-            # Standard tlmgr install
-            installation_methods.append({
-                "description": "Standard tlmgr install",
-                "command_creator": lambda pkg: ["tlmgr", "install", pkg]
-            })
-            
-            # User mode
-            installation_methods.append({
-                "description": "User mode",
-                "command_creator": lambda pkg: ["tlmgr", "--usermode", "install", pkg]
-            })
-            
-            # Sudo
-            installation_methods.append({
-                "description": "Sudo with tlmgr",
-                "command_creator": lambda pkg: ["sudo", "tlmgr", "install", pkg],
-                "requires_admin": True
-            })
+            installation_methods.extend(_TLMGR_INSTALL_METHODS)
         else:
             # If outdated, suggest updating TeX Live
             logger.info("Attempting TeX Live update for outdated installation...")
             try:
                 update_cmd = ["tlmgr", "update", "--self", "--all"]
-                update_result = subprocess.run(update_cmd, capture_output=True, text=True, check=False)
+                update_result = subprocess.run(update_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                               text=True, check=False)
                 if update_result.returncode == 0:
                     logger.info("Successfully updated TeX Live")
                     
                     # Now add TeX Live methods since we've updated
-                    installation_methods.append({
-                        "description": "Standard tlmgr install (after update)",
-                        "command_creator": lambda pkg: ["tlmgr", "install", pkg]
-                    })
-                    
-                    installation_methods.append({
-                        "description": "User mode (after update)",
-                        "command_creator": lambda pkg: ["tlmgr", "--usermode", "install", pkg]
-                    })
+                    installation_methods.extend(_TLMGR_UPDATED_INSTALL_METHODS)
                 else:
                     logger.warning(f"TeX Live update failed: {update_result.stderr}")
             except Exception as e:
@@ -716,7 +1056,8 @@ def install_texlive_packages(packages):
             try:
                 logger.info("Attempting to initialize tlmgr user mode...")
                 init_cmd = ["tlmgr", "init-usertree"]
-                init_result = subprocess.run(init_cmd, capture_output=True, text=True, check=False)
+                init_result = subprocess.run(init_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                             text=True, check=False)
                 if init_result.returncode == 0:
                     logger.info("Successfully initialized tlmgr user mode")
                 else:
@@ -725,60 +1066,55 @@ def install_texlive_packages(packages):
             except Exception as e:
                 logger.warning(f"Error initializing user mode: {str(e)}")
         
+        # Probe all apt candidates in parallel; a method whose packages are already
+        # installed would be a no-op apt-get run, so it counts as success without spawning one
+        installed = probe_installed_packages(
+            {pkg for method in installation_methods for pkg in method.get("apt_packages", [])}
+        )
+        
+        # Skip methods requiring admin if we're not running as admin (probed once, not per method)
+        if any(method.get("requires_admin", False) for method in installation_methods) \
+                and not has_admin_privileges():
+            for method in installation_methods:
+                if method.get("requires_admin", False):
+                    logger.warning(f"Skipping {method['description']} method (requires admin privileges)")
+            installation_methods = [m for m in installation_methods if not m.get("requires_admin", False)]
+        
+        # Cheapest methods first: user-level before admin, then by priority (stable for ties)
+        installation_methods.sort(key=lambda m: (m.get("requires_admin", False), -m.get("priority", 0)))
+        
         # Try each installation method until one works
         for method in installation_methods:
-            # Skip methods requiring admin if we're not running as admin
-            if method.get("requires_admin", False):
-                is_admin = os.geteuid() == 0 if hasattr(os, 'geteuid') else False
-                if not is_admin:
-                    try:
-                        # Check if sudo is available without password prompt
-                        subprocess.run(["sudo", "-n", "true"], check=True, capture_output=True)
-                    except (subprocess.CalledProcessError, FileNotFoundError):
-                        logger.warning(f"Skipping {method['description']} method (requires admin privileges)")
-                        continue
+            apt_packages = method.get("apt_packages")
+            if apt_packages and all(installed[pkg] for pkg in apt_packages):
+                logger.info(f"{', '.join(apt_packages)} already installed, nothing to do for {method['description']}")
+                return True
             
             logger.info(f"Trying to install packages using {method['description']} method...")
             
-            # Bulk install methods (install all packages at once)
-            if method.get("bulk_install", False):
-                try:
-                    cmd = method["command_creator"](None)  # Doesn't need a package name
-                    logger.info(f"Running: {' '.join(cmd)}")
-                    result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=300)
-                    
-                    if result.returncode == 0:
-                        logger.info(f"Successfully installed LaTeX packages using {method['description']}")
-                        return True
-                    else:
-                        logger.warning(f"Failed to install using {method['description']}: {result.stderr}")
-                except Exception as e:
-                    logger.warning(f"Error with {method['description']}: {str(e)}")
-                    continue
-            
-            # Individual package installation
-            else:
-                success = True
-                for pkg in packages:
-                    try:
-                        cmd = method["command_creator"](pkg)
-                        logger.info(f"Running: {' '.join(cmd)}")
-                        result = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=60)
-                        
-                        if result.returncode == 0:
-                            logger.info(f"Successfully installed {pkg} using {method['description']}")
-                        else:
-                            logger.warning(f"Failed to install {pkg} using {method['description']}: {result.stderr}")
-                            success = False
-                            break
-                    except Exception as e:
-                        logger.warning(f"Error installing {pkg} using {method['description']}: {str(e)}")
-                        success = False
-                        break
+            try:
+                cmd = method["command_creator"](packages)
+                logger.info(f"Running: {' '.join(cmd)}")
+                # Meta-package installs are one large download; tlmgr gets time per package
+                timeout = 300 if method.get("bulk_install", False) else 60 * max(1, len(packages))
+                result = run_streaming(cmd, timeout=timeout)
                 
-                if success:
-                    logger.info(f"All packages installed successfully using {method['description']}")
+                if result.returncode == 0:
+                    logger.info(f"Successfully installed LaTeX packages using {method['description']}")
+                    invalidate_tex_caches()
+                    if installed_commands is not None:
+                        installed_commands.append(cmd)
                     return True
+                
+                failed = _TLMGR_MISSING_RE.findall(result.stderr)
+                if failed:
+                    for pkg in dict.fromkeys(failed):
+                        logger.warning(f"Failed to install {pkg} using {method['description']}")
+                else:
+                    logger.warning(f"Failed to install using {method['description']}: {result.stderr}")
+            except Exception as e:
+                logger.warning(f"Error with {method['description']}: {str(e)}")
+                continue
         
         # If we get here, all methods failed
         logger.error("All installation methods failed. Manual installation is required.")
@@ -800,32 +1136,41 @@ def install_texlive_packages(packages):
         logger.error(f"Error installing LaTeX packages: {str(e)}")
         return False
 
-def install_miktex_packages(packages):
-    """Install packages using MiKTeX's package manager"""
+def install_miktex_packages(packages, installed_commands=None):
+    """
+    Install packages using MiKTeX's package manager
+    The commands that succeeded are appended to installed_commands if given
+    """
     try:
-        for pkg in packages:
-            logger.info(f"Installing MiKTeX package: {pkg}")
-            
-            # MiKTeX's package manager command
-            cmd = ["mpm", "--install", pkg]
-            
-            # Run the installation command
-            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-            
-            if result.returncode != 0:
-                logger.warning(f"Failed to install {pkg}: {result.stderr}")
-                # Try with admin mode
-                logger.info(f"Retrying with admin privileges...")
-                admin_cmd = ["mpm", "--admin", "--install", pkg]
-                try:
-                    admin_result = subprocess.run(admin_cmd, capture_output=True, text=True, check=False)
-                    if admin_result.returncode != 0:
-                        logger.warning(f"Failed to install with admin privileges: {admin_result.stderr}")
-                        return False
-                except Exception:
-                    logger.warning("Failed to run with admin privileges. Please install manually.")
+        logger.info(f"Installing MiKTeX packages: {', '.join(packages)}")
+        
+        # mpm takes several --install options, so one process handles the whole set
+        install_args = [arg for pkg in packages for arg in ("--install", pkg)]
+        cmd = ["mpm"] + install_args
+        
+        # Run the installation command
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+        
+        if result.returncode != 0:
+            logger.warning(f"Failed to install {', '.join(packages)}: {result.stderr}")
+            # Try with admin mode
+            logger.info(f"Retrying with admin privileges...")
+            admin_cmd = ["mpm", "--admin"] + install_args
+            try:
+                admin_result = subprocess.run(admin_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                              text=True, check=False)
+                if admin_result.returncode != 0:
+                    logger.warning(f"Failed to install with admin privileges: {admin_result.stderr}")
                     return False
+                cmd = admin_cmd
+            except Exception:
+                logger.warning("Failed to run with admin privileges. Please install manually.")
+                return False
+        
+        if installed_commands is not None:
+            installed_commands.append(cmd)
         
+        invalidate_tex_caches()
         return True
     except Exception as e:
         logger.error(f"Error installing MiKTeX packages: {str(e)}")
@@ -834,22 +1179,33 @@ def install_miktex_packages(packages):
 def open_pdf(pdf_path):
     """Open the PDF file with the default PDF viewer"""
     try:
-        import platform
-        system = platform.system()
-        
         logger.info(f"Opening PDF with system viewer...")
         
-        if system == 'Darwin':  # macOS
+        if _SYSTEM == 'Darwin':  # macOS
             subprocess.run(['open', pdf_path], check=False)
-        elif system == 'Windows':
+        elif _SYSTEM == 'Windows':
             os.startfile(pdf_path)  # Windows-specific
         else:  # Linux and other Unix-like
-            subprocess.run(['xdg-open', pdf_path], check=False)
+            subprocess.run([_PDF_VIEWER or 'xdg-open', pdf_path], check=False)
             
     except Exception as e:
         logger.error(f"Error opening PDF: {str(e)}")
 
 
+def read_pdf_header(pdf_path):
+    """
+    Return (size_bytes, first five bytes) of pdf_path from a single open,
+    or None if the file does not exist
+    """
+    try:
+        fd = os.open(pdf_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        return os.fstat(fd).st_size, os.read(fd, 5)
+    finally:
+        os.close(fd)
+
 def validate_pdf_creation(pdf_path, log_output, return_code):
     """
     Properly validate if a PDF was created successfully based on multiple criteria
@@ -862,8 +1218,12 @@ def validate_pdf_creation(pdf_path, log_output, return_code):
     Returns:
         tuple: (pdf_exists, pdf_valid, error_message)
     """
-    # Step 1: Check if the file exists
-    pdf_exists = os.path.exists(pdf_path)
+    # Step 1: Check if the file exists (the same open gives the size and header for step 4)
+    try:
+        pdf_info = read_pdf_header(pdf_path)
+    except OSError as e:
+        return True, False, f"Error validating PDF: {str(e)}"
+    pdf_exists = pdf_info is not None
     
     # Step 2: Check the return code from pdflatex
     compile_success = return_code == 0
@@ -872,21 +1232,11 @@ def validate_pdf_creation(pdf_path, log_output, return_code):
     fatal_error = False
     fatal_error_message = None
     
-    error_patterns = [
-        "Fatal error occurred",
-        "Emergency stop",
-        "==> Fatal error occurred",
-        "no output PDF file produced"
-    ]
-    
-    for line in log_output.split('\n'):
-        for pattern in error_patterns:
-            if pattern in line:
-                fatal_error = True
-                fatal_error_message = line.strip()
-                break
-        if fatal_error:
-            break
+    match = _FATAL_RE.search(log_output)
+    if match:
+        fatal_error = True
+        # Report the whole line the error was found on
+        fatal_error_message = _line_context(log_output, match.start(), before=0, after=0).strip()
     
     # Step 4: If file exists, check if it's a valid PDF by examining the size and header
     pdf_valid = False
@@ -894,12 +1244,10 @@ def validate_pdf_creation(pdf_path, log_output, return_code):
     if pdf_exists:
         try:
             # Check file size - very small PDFs might be empty or corrupt
-            size_bytes = os.path.getsize(pdf_path)
+            size_bytes, header = pdf_info
             
             # Check for PDF header - valid PDFs start with %PDF-
-            with open(pdf_path, 'rb') as f:
-                header = f.read(5)
-                has_pdf_header = header == b'%PDF-'
+            has_pdf_header = header == b'%PDF-'
             
             # Minimum size threshold (adjust as needed)
             min_size = 1000  # 1 KB is very small for a real PDF
@@ -916,79 +1264,474 @@ def validate_pdf_creation(pdf_path, log_output, return_code):
         except Exception as e:
             return pdf_exists, False, f"Error validating PDF: {str(e)}"
     
-    # PDF doesn't exist or compilation had fatal errors
-    error_msg = fatal_error_message if fatal_error else f"LaTeX compilation failed (return code {return_code})"
-    return pdf_exists, False, error_msg
+    # PDF doesn't exist or compilation had fatal errors
+    error_msg = fatal_error_message if fatal_error else f"LaTeX compilation failed (return code {return_code})"
+    return pdf_exists, False, error_msg
+
+
+def is_network_filesystem(path):
+    """
+    Check /proc/mounts to see if path lives on an NFS/CIFS/SSHFS mount,
+    where inotify does not see changes made by other machines
+    """
+    network_types = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "fuse.sshfs")
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/mounts", 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point, fs_type = fields[1], fields[2]
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+                        and len(mount_point) > len(best_mount):
+                    best_mount, best_type = mount_point, fs_type
+    except OSError:
+        return False
+    return best_type in network_types
+
+
+class InotifyFileWatcher:
+    """
+    Watch a single file with inotify and call back for every batch of saves.
+
+    The watch is placed on the parent directory (so editors that save via
+    rename are still seen) but only CLOSE_WRITE / MOVED_TO events for the
+    target file name are considered. Each wakeup waits `batch_delay` seconds
+    after the first event so a burst of saves is read from the inotify queue
+    in one batch; debouncing is left to the callback (LatexFileHandler.handle_change),
+    which bounds how long a change can wait.
+    Exposes the same start/stop/join interface as a watchdog Observer.
+    """
+    def __init__(self, file_path, callback, batch_delay=0.05):
+        self.file_path = os.path.abspath(file_path)
+        self.file_name = os.path.basename(self.file_path)
+        self.callback = callback
+        self.batch_delay = batch_delay
+        self._inotify = INotify()
+        self._inotify.add_watch(os.path.dirname(self.file_path),
+                                inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        self._inotify.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            events = self._inotify.read(timeout=1000, read_delay=int(self.batch_delay * 1000))
+            if any(event.name == self.file_name for event in events):
+                try:
+                    self.callback()
+                except Exception as e:
+                    logger.error(f"Error handling change in {self.file_path}: {str(e)}")
+
+
+def create_file_watcher(event_handler, file_path, watch_interval=30):
+    """
+    Create the watcher that drives event_handler for file_path
+    Prefers an inotify watch on the file, polls on network filesystems,
+    and falls back to a watchdog Observer elsewhere. Projects with several
+    files use one Observer over the whole project directory
+    """
+    watch_dir = os.path.dirname(os.path.abspath(file_path))
+    multi_file = len(event_handler.file_paths) > 1
+    
+    if is_network_filesystem(watch_dir):
+        logger.info(f"{watch_dir} is on a network filesystem, polling every {watch_interval} seconds")
+        observer = PollingObserver(timeout=watch_interval)
+    elif INotify is not None and not multi_file:
+        return InotifyFileWatcher(file_path, event_handler.handle_change)
+    elif InotifyObserver is not None:
+        # Ask for inotify explicitly rather than letting Observer fall back to polling
+        observer = InotifyObserver()
+    else:
+        observer = Observer()
+    
+    observer.schedule(event_handler, watch_dir, recursive=multi_file)
+    return observer
+
+
+class AdaptivePollSchedule:
+    """
+    Decide how long a remote checker sleeps between polls.
+
+    Polls are placed at quantiles of the observed time between remote
+    commits, so they cluster where the next commit is most likely and thin
+    out past the 0.99 quantile, where the longest interval is used. Until a
+    few commits have been seen the base interval is used unchanged.
+    """
+    def __init__(self, base_interval, polls_per_gap=8, history=50, max_factor=6):
+        self.base_interval = base_interval
+        self.min_interval = max(1.0, base_interval / 4)
+        self.max_interval = base_interval * max_factor
+        self.polls_per_gap = polls_per_gap
+        self._intervals = collections.deque(maxlen=history)
+        self._last_change = time.monotonic()
+
+    def record_change(self):
+        """Note that new remote commits were detected; the schedule restarts from here"""
+        now = time.monotonic()
+        self._intervals.append(now - self._last_change)
+        self._last_change = now
+
+    def next_delay(self):
+        if len(self._intervals) < 3:
+            return self.base_interval
+        
+        elapsed = time.monotonic() - self._last_change
+        poll_points = statistics.quantiles(self._intervals, n=self.polls_per_gap, method='inclusive')
+        poll_points.append(statistics.quantiles(self._intervals, n=100, method='inclusive')[-1])
+        delay = next((point - elapsed for point in poll_points if point > elapsed), self.max_interval)
+        return min(max(delay, self.min_interval), self.max_interval)
+
+
+def svg_needs_rebuild(svg_path):
+    """True if the PDF next to svg_path is missing or older than the SVG"""
+    pdf_path = svg_path.with_suffix('.pdf')
+    try:
+        return pdf_path.stat().st_mtime < svg_path.stat().st_mtime
+    except FileNotFoundError:
+        return True
+
+def convert_svg_figures(project_dir, content):
+    """
+    Convert outdated SVG figures referenced by the document to PDF
+    All conversions are piped through a single `inkscape --shell` process
+    instead of starting inkscape once per figure. Figures included via
+    \\input{name.pdf_tex} are exported with export-latex
+    Returns the number of figures converted
+    """
+    if not shutil.which("inkscape"):
+        return 0
+    
+    svgs = [
+        svg for svg in Path(project_dir).glob('**/*.svg')
+        if svg.stem in content and ';' not in str(svg) and svg_needs_rebuild(svg)
+    ]
+    if not svgs:
+        return 0
+    
+    commands = []
+    for svg in svgs:
+        pdf = svg.with_suffix('.pdf')
+        export_latex = "export-latex;" if f"{svg.stem}.pdf_tex" in content else ""
+        commands.append(f"file-open:{svg};export-filename:{pdf};{export_latex}export-do;file-close")
+    
+    logger.info(f"Converting {len(svgs)} SVG figure(s) with inkscape...")
+    try:
+        result = subprocess.run(
+            ["inkscape", "--shell"],
+            input="\n".join(commands) + "\nquit\n",
+            capture_output=True,
+            text=True,
+            check=False,
+            timeout=300
+        )
+        if result.returncode != 0:
+            logger.warning(f"inkscape reported errors converting SVG figures: {result.stderr}")
+    except Exception as e:
+        logger.warning(f"Error converting SVG figures: {str(e)}")
+    
+    return len(svgs)
+
+# Commands in a preamble that pull in other files, and the extensions those files may have
+_PREAMBLE_INCLUDE_PATTERN = re.compile(
+    r"\\(input|include|usepackage|RequirePackage|documentclass|LoadClass)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}")
+_PREAMBLE_INCLUDE_EXTENSIONS = {
+    'input': ('', '.tex'), 'include': ('.tex',),
+    'usepackage': ('.sty',), 'RequirePackage': ('.sty',),
+    'documentclass': ('.cls',), 'LoadClass': ('.cls',),
+}
+
+def preamble_dependencies(preamble, cwd=None):
+    """
+    (path, mtime_ns, size) of each project-local file the preamble pulls in via
+    \\input, \\include, \\usepackage, \\documentclass and friends, so that a format
+    built from it goes stale when one of them changes. Installed packages are not local and skipped
+    """
+    dependencies = []
+    for command, names in _PREAMBLE_INCLUDE_PATTERN.findall(preamble):
+        for name in names.split(','):
+            name = name.strip()
+            for extension in _PREAMBLE_INCLUDE_EXTENSIONS[command]:
+                path = os.path.join(cwd or ".", name + extension)
+                stat = _try_stat(path)
+                if stat is not None and not os.path.isdir(path):
+                    dependencies.append((name + extension, stat.st_mtime_ns, stat.st_size))
+                    break
+    return dependencies
+
+def build_preamble_format(file_name, content, env=None, cwd=None):
+    """
+    Dump the document preamble into a pdflatex format with mylatexformat
+    Starting pdflatex from this format skips loading the preamble's packages
+    on every pass. The format is only rebuilt when the preamble or a local
+    file it loads changes
+    cwd is the directory containing file_name (default: current directory)
+    Returns the format name to pass to pdflatex_command, or None if unavailable
+    """
+    marker = content.find("\\begin{document}")
+    if marker == -1:
+        return None
+    
+    preamble = content[:marker]
+    preamble_key = repr((preamble, preamble_dependencies(preamble, cwd)))
+    preamble_hash = hashlib.sha1(preamble_key.encode('utf-8', errors='replace')).hexdigest()
+    format_name = f"{os.path.splitext(file_name)[0]}-preamble"
+    format_base = os.path.join(cwd or ".", format_name)
+    hash_file = f"{format_base}.hash"
+    
+    try:
+        with open(hash_file, 'r') as f:
+            if f.read().strip() == preamble_hash and os.path.exists(f"{format_base}.fmt"):
+                return format_name
+    except OSError:
+        pass
+    
+    logger.info("Preamble changed, rebuilding precompiled preamble format...")
+    try:
+        result = subprocess.run(
+            ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={format_name}",
+             "&pdflatex", "mylatexformat.ltx", file_name],
+            capture_output=True,
+            text=True,
+            encoding='latin-1',
+            errors='replace',
+            check=False,
+            env=env,
+            cwd=cwd
+        )
+    except Exception as e:
+        logger.warning(f"Could not build preamble format: {str(e)}")
+        return None
+    
+    if result.returncode != 0 or not os.path.exists(f"{format_base}.fmt"):
+        logger.warning("Could not build preamble format (is mylatexformat installed?), compiling without it")
+        return None
+    
+    with open(hash_file, 'w') as f:
+        f.write(preamble_hash)
+    return format_name
+
+def pdflatex_command(file_name, pass_number, total_passes, fmt=None):
+    """
+    Build the pdflatex command line for one pass of a multi-pass compile
+    Passes before the last use -draftmode, which still writes the .aux file
+    but skips producing PDF pages. Runs WITHOUT halt-on-error so that a
+    PDF is produced even when the document has errors
+    fmt selects a precompiled format such as one from build_preamble_format
+    """
+    cmd = [
+        "pdflatex",
+        "-interaction=nonstopmode",  # Continue despite errors
+        "-file-line-error",          # Show file and line numbers for errors
+    ]
+    if fmt:
+        cmd.append(f"-fmt={fmt}")
+    if pass_number < total_passes:
+        cmd.append("-draftmode")
+    cmd.append(file_name)
+    return cmd
+
+def latexmk_command(file_name, fmt=None):
+    """
+    Build a latexmk command that runs only the pdflatex/bibtex passes the
+    document actually needs, forcing on past errors like the manual passes do
+    """
+    pdflatex = "pdflatex %O %S" if fmt is None else f"pdflatex -fmt={shlex.quote(fmt)} %O %S"
+    return ["latexmk", "-pdf", "-f", f"-pdflatex={pdflatex}",
+            "-interaction=nonstopmode", "-file-line-error", file_name]
+
+def acquire_compile_lock(tex_file):
+    """
+    Take a non-blocking advisory lock on <name>.compile.lock next to tex_file
+    Returns the lock file descriptor, or None if another compile holds the lock
+    """
+    lock_path = os.path.splitext(tex_file)[0] + ".compile.lock"
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+def release_compile_lock(fd):
+    """Release a lock taken with acquire_compile_lock"""
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
 
 
 class LatexFileHandler(FileSystemEventHandler):
-    def __init__(self, file_path, git_repo_path):
+    def __init__(self, file_path, git_repo_path, extra_files=None):
         self.file_path = os.path.abspath(file_path)
         self.git_repo_path = os.path.abspath(git_repo_path)
-        self.last_modified = time.time()
-        self.cooldown = 5  # Cooldown period in seconds to avoid multiple triggers
+        # The main document plus any other project files (e.g. chapters) to sync. Each one is
+        # mirrored at the same place relative to the main document, so it has to live under its directory
+        project_dir = os.path.dirname(self.file_path)
+        file_paths = [self.file_path]
+        for extra_file in extra_files or []:
+            extra_path = os.path.abspath(extra_file)
+            if os.path.commonpath([project_dir, extra_path]) != project_dir:
+                logger.warning(f"Not syncing {extra_path}: it is outside the project directory {project_dir}")
+                send_box(f"Not syncing {extra_path}: it is outside the project directory {project_dir}", title="Error", level=1)
+                continue
+            file_paths.append(extra_path)
+        self.file_paths = frozenset(file_paths)
+        self._pending_paths = set()
+        self._min_gap = 0.1  # Quiet period that ends a burst of change events
+        self._max_latency = 0.5  # A churning file is still synced at least this often
+        self._last_fire = 0.0
+        self._first_pending = None
+        self._pending_timer = None
+        self._debounce_guard = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_hashes = {}  # Digest of the content last pushed to Overleaf, per file
+        self._last_remote_sha = None  # Remote master SHA at the last fully handled remote check
+        self.recompile_delay = 0.5  # Delay before the trailing recompile when a compile was already running
+        self._recompile_timer = None
+        self._recompile_guard = threading.Lock()
 
     def on_modified(self, event):
-        if os.environ.get('GIT_PUSH_DISABLED', False) == 'True':
+        if event.src_path in self.file_paths:
+            self.handle_change(event.src_path)
+
+    def handle_change(self, path=None):
+        """
+        Debounce change events: the first event of a burst syncs immediately,
+        later ones are coalesced into a trailing sync _min_gap after the last
+        event, but no event waits longer than _max_latency
+        Every file changed during the burst (default: the main file) is synced
+        """
+        if sync_flags.git_push_disabled.is_set():
             return
         
-        if event.src_path == self.file_path:
-            current_time = time.time()
-            # Check if cooldown period has passed
-            if current_time - self.last_modified > self.cooldown or \
-                os.environ.get('LATEX_COLAB_AGENT_STREAMING', False) == 'True':
+        now = time.monotonic()
+        with self._debounce_guard:
+            self._pending_paths.add(path or self.file_path)
+            if self._pending_timer is None and now - self._last_fire > self._max_latency:
+                self._last_fire = now
+                fire_now = True
+            else:
+                fire_now = False
+                if self._first_pending is None:
+                    self._first_pending = now
+                delay = min(self._min_gap, max(0.0, self._first_pending + self._max_latency - now))
+                if self._pending_timer is not None:
+                    self._pending_timer.cancel()
+                self._pending_timer = threading.Timer(delay, self._flush_pending)
+                self._pending_timer.daemon = True
+                self._pending_timer.start()
+        
+        if fire_now:
+            self._sync_change()
 
-                self.last_modified = current_time
-                logger.info(f"Change detected in {self.file_path}")
-                self.sync_with_overleaf()
+    def _flush_pending(self):
+        with self._debounce_guard:
+            self._pending_timer = None
+            self._first_pending = None
+            self._last_fire = time.monotonic()
+        self._sync_change()
 
-    def sync_with_overleaf(self):
+    def _sync_change(self):
+        with self._sync_lock:
+            with self._debounce_guard:
+                paths, self._pending_paths = self._pending_paths, set()
+            for path in sorted(paths):
+                logger.info(f"Change detected in {path}")
+                self.sync_with_overleaf(path)
+
+    def sync_with_overleaf(self, path=None):
         try:
-            original_dir = os.getcwd()
             compile_success = True
+            source_path = path or self.file_path
             
-            # Copy the modified file to the git repository
-            file_name = os.path.basename(self.file_path)
+            # Copy the modified file to the git repository, at the same place
+            # relative to the main document
+            file_name = self._repo_relpath(source_path)
             dest_path = os.path.join(self.git_repo_path, file_name)
             
-            with open(self.file_path, 'r', encoding='utf-8') as source_file:
-                content = source_file.read()
+            # Copied as raw bytes: the repository copy needs no decode/encode round trip
+            with open(source_path, 'rb') as source_file:
+                data = source_file.read()
 
-            if not content:
+            if not data:
                 return
-                
-            with open(dest_path, 'w', encoding='utf-8') as dest_file:
-                dest_file.write(content)
+            
+            # Editors often rewrite identical bytes; nothing to compile or push then.
+            # Keyed per file so edits to different files never suppress each other
+            content_hash = hashlib.blake2b(data, digest_size=16).digest()
+            if content_hash == self._last_hashes.get(source_path):
+                return
+            
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            with open(dest_path, 'wb') as dest_file:
+                dest_file.write(data)
             
             # Compile locally if requested
             if hasattr(self, 'local_compilation') and self.local_compilation:
                 try:
-                    self.compile_locally()
+                    # Hand over the main document's text so the compile doesn't read it again
+                    content = None
+                    if source_path == self.file_path:
+                        try:
+                            content = data.decode('utf-8')
+                        except UnicodeDecodeError:
+                            content = data.decode('latin-1', errors='replace')
+                    self.compile_locally(content=content)
                 except Exception as e:
                     logger.error(f"Local compilation failed but continuing with git sync: {str(e)}")
                     compile_success = False
             
-            # Git operations - move to git repo directory first
-            os.chdir(self.git_repo_path)
-            
-            # Add and commit the file
+            # Add and commit the file (git runs in the repository via cwd, so the
+            # process-wide working directory is never changed under other threads)
             try:
-                subprocess.run(["git", "add", file_name], check=True)
-                subprocess.run(["git", "commit", "-m", f"Auto-update: {file_name}"], check=True)
+                # Only commit when the file actually differs from HEAD
+                status = subprocess.run(["git", "status", "--porcelain", "--", file_name],
+                                        check=True, capture_output=True, text=True,
+                                        cwd=self.git_repo_path).stdout
+                staged = False
+                if status.strip():
+                    subprocess.run(["git", "add", file_name], check=True, cwd=self.git_repo_path)
+                    staged = subprocess.run(["git", "diff", "--cached", "--quiet"],
+                                            cwd=self.git_repo_path).returncode != 0
+                    if staged:
+                        subprocess.run(["git", "commit", "-m", f"Auto-update: {file_name}"], check=True,
+                                       cwd=self.git_repo_path)
+                
+                # Nothing new to commit: still push if an earlier push failed, otherwise we're done
+                if not staged:
+                    unpushed = subprocess.run(["git", "rev-list", "--count", "origin/master..HEAD"],
+                                              capture_output=True, text=True,
+                                              cwd=self.git_repo_path).stdout.strip()
+                    if unpushed == "0":
+                        logger.info(f"No changes to {file_name} to push")
+                        self._last_hashes[source_path] = content_hash
+                        return
                 
                 # Push to Overleaf
                 logger.info("Pushing changes to Overleaf...")
                 result = subprocess.run(["git", "push", "origin", "master"], 
                                        check=True, 
                                        capture_output=True, 
-                                       text=True)
+                                       text=True,
+                                       cwd=self.git_repo_path)
                 
                 logger.info("Successfully pushed changes to Overleaf!")
+                self._last_hashes[source_path] = content_hash
             except subprocess.CalledProcessError as e:
                 logger.error(f"Git operation failed: {e.stderr if hasattr(e, 'stderr') else str(e)}")
-            finally:
-                # Return to original directory
-                os.chdir(original_dir)
             
             # Trigger compilation via API if API credentials provided and local compilation not requested
             #if hasattr(self, 'overleaf_api') and self.overleaf_api and not (hasattr(self, 'local_compilation') and self.local_compilation):
@@ -996,39 +1739,62 @@ class LatexFileHandler(FileSystemEventHandler):
             
         except Exception as e:
             logger.error(f"Error syncing with Overleaf: {str(e)}")
-            # Make sure we're back in the original directory
-            try:
-                os.chdir(original_dir)
-            except:
-                pass
 
-    def compile_locally(self):
+    def compile_locally(self, content=None):
+        """
+        Compile the LaTeX document locally, unless a compile is already running
+        Overlapping requests are coalesced into one trailing recompile
+        content is the already-read document text; it is read from disk if None
+        """
+        lock_fd = acquire_compile_lock(self.file_path)
+        if lock_fd is None:
+            logger.info("Compilation already in progress, scheduling a recompile once it finishes")
+            self._schedule_recompile()
+            return False
+        try:
+            return self._run_pdflatex(content)
+        finally:
+            release_compile_lock(lock_fd)
+
+    def _schedule_recompile(self):
+        """Schedule a single trailing compile_locally call, dropping further requests until it runs"""
+        with self._recompile_guard:
+            if self._recompile_timer is not None:
+                return
+            self._recompile_timer = threading.Timer(self.recompile_delay, self._trailing_recompile)
+            self._recompile_timer.daemon = True
+            self._recompile_timer.start()
+
+    def _trailing_recompile(self):
+        with self._recompile_guard:
+            self._recompile_timer = None
+        self.compile_locally()
+
+    def _run_pdflatex(self, content=None):
         """Compile the LaTeX document locally using pdflatex, continue despite errors"""
         try:
             file_name = os.path.basename(self.file_path)
+            # All tools run with cwd=output_dir, the directory containing the LaTeX file
             output_dir = os.path.dirname(self.file_path)
             
-            # Change to the directory containing the LaTeX file
-            current_dir = os.getcwd()
-            os.chdir(os.path.dirname(self.file_path))
-            
             # Get the base filename for the PDF
             base_name = os.path.splitext(file_name)[0]
-            pdf_path = f"{base_name}.pdf"
+            pdf_path = os.path.join(output_dir, f"{base_name}.pdf")
             
-            # Read the LaTeX file to extract required packages
+            # Read the LaTeX file to extract required packages, unless the caller already did
             # Add error handling for UTF-8 decoding issues
-            try:
-                with open(self.file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                # Try with a more forgiving encoding
-                logger.warning("UTF-8 decode error, trying with latin-1 encoding")
-                with open(self.file_path, 'r', encoding='latin-1', errors='replace') as f:
-                    content = f.read()
+            if content is None:
+                try:
+                    with open(self.file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                except UnicodeDecodeError:
+                    # Try with a more forgiving encoding
+                    logger.warning("UTF-8 decode error, trying with latin-1 encoding")
+                    with open(self.file_path, 'r', encoding='latin-1', errors='replace') as f:
+                        content = f.read()
             
             # Extract required packages
-            required_packages = extract_packages_from_source(content)
+            required_packages = packages_for_content(content)
             if required_packages:
                 logger.info(f"Document requires these packages: {', '.join(required_packages)}")
                 
@@ -1039,99 +1805,128 @@ class LatexFileHandler(FileSystemEventHandler):
                 
                 if auto_install:
                     logger.info("Attempting to install required packages...")
-                    install_texlive_packages(required_packages)
+                    # Replay this project's saved install script while the package set is unchanged
+                    if not run_install_script(output_dir, required_packages):
+                        installed_commands = []
+                        if install_texlive_packages(required_packages, installed_commands):
+                            write_install_script(output_dir, required_packages, installed_commands)
             
             # Set up environment variables
             env = os.environ.copy()
             
-            # Create pdflatex command WITHOUT halt-on-error
-            pdflatex_cmd = [
-                "pdflatex",
-                "-interaction=nonstopmode",  # Continue despite errors
-                "-file-line-error",          # Show file and line numbers for errors
-                file_name
-            ]
+            # Check for citations and references
+            has_citations = "\\cite{" in content or "\\citep{" in content or "\\citet{" in content
+            has_references = "\\ref{" in content or "\\pageref{" in content or "\\eqref{" in content
             
-            # First pass - run pdflatex
-            logger.info(f"Compiling {file_name} locally using pdflatex (continue-on-error mode)...")
-            result = subprocess.run(
-                pdflatex_cmd,
-                capture_output=True,
-                # Use errors='replace' to handle encoding issues
-                text=True,
-                encoding='latin-1',
-                errors='replace',
-                check=False,
-                env=env
-            )
+            # Citations and references need two extra passes; only the last one has to ship pages
+            # (used when latexmk is not installed)
+            total_passes = 3 if (has_citations or has_references) else 1
+            
+            # Bring SVG figures up to date before the first pass
+            convert_svg_figures(output_dir, content)
+            
+            # Start pdflatex from a precompiled preamble when enabled
+            fmt = None
+            if (hasattr(self, 'local_compilation') and 
+                isinstance(self.local_compilation, dict) and 
+                self.local_compilation.get('preamble_format', False)):
+                fmt = build_preamble_format(file_name, content, env, cwd=output_dir)
+            
+            # latexmk decides the passes itself (bibtex, reruns); without it run them by hand
+            use_latexmk = shutil.which("latexmk") is not None
+            if use_latexmk:
+                logger.info(f"Compiling {file_name} locally using latexmk (continue-on-error mode)...")
+                compile_cmd = latexmk_command(file_name, fmt)
+            else:
+                logger.info(f"Compiling {file_name} locally using pdflatex (continue-on-error mode)...")
+                compile_cmd = pdflatex_command(file_name, 1, total_passes, fmt)
+            # pdflatex writes everything to the .log file anyway, so its terminal output is discarded
+            log_file = os.path.join(output_dir, f"{base_name}.log")
+            return_code = subprocess.Popen(
+                compile_cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                env=env,
+                cwd=output_dir
+            ).wait()
+            
+            # Some preambles don't survive the format dump; retry once from the plain format
+            if return_code != 0 and fmt is not None:
+                logger.warning("Compile from the preamble format failed, retrying without it...")
+                fmt = None
+                compile_cmd = latexmk_command(file_name) if use_latexmk else pdflatex_command(file_name, 1, total_passes)
+                return_code = subprocess.Popen(
+                    compile_cmd,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    env=env,
+                    cwd=output_dir
+                ).wait()
+                if return_code == 0:
+                    # The format was at fault, not the document: stop using it for this session
+                    logger.warning("Compiled fine without the preamble format; disabling it for this session")
+                    self.local_compilation['preamble_format'] = False
             
             # Log errors but continue anyway
-            if result.returncode != 0:
+            if return_code != 0:
                 logger.warning("LaTeX reported errors but attempting to continue")
                 try:
-                    errors = extract_latex_errors(result.stdout)
-                    for i, error in enumerate(errors[:3], 1):  # Show first 3 errors
+                    for i, error in enumerate(read_log_errors(log_file, max_errors=3), 1):  # Show first 3 errors
                         logger.warning(f"Error {i}: {error}")
                 except Exception as e:
                     logger.warning(f"Could not extract errors: {str(e)}")
                     
                 logger.info("Continuing compilation despite errors...")
             
-            # Check for citations and references
-            has_citations = "\\cite{" in content or "\\citep{" in content or "\\citet{" in content
-            has_references = "\\ref{" in content or "\\pageref{" in content or "\\eqref{" in content
-            
             # Run additional passes if needed
-            if has_citations:
+            if has_citations and not use_latexmk:
                 logger.info("Running bibtex for citations...")
                 try:
-                    bibtex_result = subprocess.run(
+                    subprocess.run(
                         ["bibtex", base_name],
-                        capture_output=True,
-                        text=True,
-                        encoding='latin-1',
-                        errors='replace',
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
                         check=False,
-                        env=env
+                        env=env,
+                        cwd=output_dir
                     )
                 except Exception as e:
                     logger.warning(f"Error running bibtex: {str(e)}")
             
             # Run additional pdflatex passes regardless of errors
-            if has_citations or has_references:
+            if (has_citations or has_references) and not use_latexmk:
                 logger.info("Running second pdflatex pass...")
                 try:
                     subprocess.run(
-                        pdflatex_cmd,
-                        capture_output=True,
-                        text=True,
-                        encoding='latin-1',
-                        errors='replace',
+                        pdflatex_command(file_name, 2, total_passes, fmt),
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
                         check=False,
-                        env=env
+                        env=env,
+                        cwd=output_dir
                     )
                 except Exception as e:
                     logger.warning(f"Error on second pass: {str(e)}")
                 
                 logger.info("Running final pdflatex pass...")
                 try:
-                    result = subprocess.run(
-                        pdflatex_cmd,
-                        capture_output=True,
-                        text=True,
-                        encoding='latin-1',
-                        errors='replace',
+                    subprocess.run(
+                        pdflatex_command(file_name, 3, total_passes, fmt),
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
                         check=False,
-                        env=env
+                        env=env,
+                        cwd=output_dir
                     )
                 except Exception as e:
                     logger.warning(f"Error on final pass: {str(e)}")
             
             # Check if PDF was created, regardless of validity
-            pdf_exists = os.path.exists(pdf_path)
+            pdf_stat = _try_stat(pdf_path)
+            pdf_exists = pdf_stat is not None
             
             if pdf_exists:
-                size_bytes = os.path.getsize(pdf_path)
+                size_bytes = pdf_stat.st_size
                 size_kb = size_bytes / 1024
                 
                 # Even small PDFs might be valid with errors
@@ -1153,12 +1948,8 @@ class LatexFileHandler(FileSystemEventHandler):
                             self._open_pdf(abs_pdf_path)
                             logger.info("PDF opened successfully")
                         except Exception as e:
-                            logger.error(f"Exception while trying to open PDF: {str(e)}")
-                            import traceback
-                            logger.error(f"Traceback: {traceback.format_exc()}")
+                            logger.exception(f"Exception while trying to open PDF: {str(e)}")
                         
-                    # Return to original directory and report success
-                    os.chdir(current_dir)
                     return True
                 else:
                     logger.error(f"PDF file created but appears to be empty (Size: {size_kb:.2f} KB)")
@@ -1166,41 +1957,17 @@ class LatexFileHandler(FileSystemEventHandler):
                 logger.error("Failed to create any PDF output, even with error-continuation")
                 
                 # Check the log file for specific fatal errors that prevent PDF creation
-                log_file = f"{base_name}.log"
-                if os.path.exists(log_file):
-                    try:
-                        with open(log_file, 'r', encoding='latin-1', errors='replace') as f:
-                            log_content = f.read()
-                        
-                        fatal_patterns = [
-                            "Fatal error",
-                            "Emergency stop",
-                            "TeX capacity exceeded",
-                            "No output PDF file produced"
-                        ]
-                        
-                        for pattern in fatal_patterns:
-                            if pattern in log_content:
-                                logger.error(f"Fatal LaTeX error: {pattern} - This prevents any PDF output")
-                                break
-                                
-                    except Exception as e:
-                        logger.warning(f"Could not read log file: {str(e)}")
-            
-            # Return to original directory
-            os.chdir(current_dir)
+                try:
+                    fatal_error = search_log_file(log_file, _FATAL_RE_BYTES)
+                    if fatal_error:
+                        logger.error(f"Fatal LaTeX error: {fatal_error} - This prevents any PDF output")
+                except Exception as e:
+                    logger.warning(f"Could not read log file: {str(e)}")
+            
             return pdf_exists
         
         except Exception as e:
-            logger.error(f"Exception during LaTeX compilation: {str(e)}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            
-            # Return to original directory
-            try:
-                os.chdir(current_dir)
-            except:
-                pass
+            logger.exception(f"Exception during LaTeX compilation: {str(e)}")
             
             return False
     
@@ -1210,18 +1977,16 @@ class LatexFileHandler(FileSystemEventHandler):
         with improved error handling and debugging
         """
         try:
-            import platform
-            system = platform.system()
-            
             logger.info(f"Attempting to open PDF with system viewer: {pdf_path}")
             
             # Check if the file exists first
-            if not os.path.exists(pdf_path):
+            pdf_stat = _try_stat(pdf_path)
+            if pdf_stat is None:
                 logger.error(f"PDF file does not exist at path: {pdf_path}")
                 return False
             
             # Check file size
-            size_bytes = os.path.getsize(pdf_path)
+            size_bytes = pdf_stat.st_size
             if size_bytes < 100:
                 logger.warning(f"PDF file may be invalid (too small: {size_bytes} bytes)")
                 # Continue anyway
@@ -1231,45 +1996,27 @@ class LatexFileHandler(FileSystemEventHandler):
             logger.info(f"File size: {size_bytes} bytes")
             
             # Try to open based on platform
-            if system == 'Darwin':  # macOS
+            if _SYSTEM == 'Darwin':  # macOS
                 logger.info("Using macOS 'open' command")
                 subprocess.run(['open', pdf_path], check=False)
-            elif system == 'Windows':
+            elif _SYSTEM == 'Windows':
                 logger.info("Using Windows os.startfile")
                 os.startfile(pdf_path)  # Windows-specific
             else:  # Linux and other Unix-like
-                logger.info("Using xdg-open for Linux/Unix")
+                # xdg-open, or the first alternative viewer found at startup
+                if _PDF_VIEWER is None:
+                    logger.error("Could not find any suitable PDF viewer. Please install one.")
+                    return False
                 
-                # First try xdg-open
-                try:
-                    subprocess.run(['xdg-open', pdf_path], check=False)
-                except FileNotFoundError:
-                    # Try alternative viewers
-                    viewers = ['evince', 'okular', 'atril', 'firefox', 'google-chrome']
-                    success = False
-                    
-                    for viewer in viewers:
-                        try:
-                            subprocess.run([viewer, pdf_path], check=False)
-                            logger.info(f"Opened PDF with {viewer}")
-                            success = True
-                            break
-                        except FileNotFoundError:
-                            continue
-                    
-                    if not success:
-                        logger.error("Could not find any suitable PDF viewer. Please install one.")
-                        return False
+                logger.info(f"Using {_PDF_VIEWER} for Linux/Unix")
+                subprocess.run([_PDF_VIEWER, pdf_path], check=False)
             
             logger.info("PDF viewer command executed successfully")
             return True
                     
         except Exception as e:
-            logger.error(f"Error opening PDF: {str(e)}")
-            
-            # More detailed error information
-            import traceback
-            logger.error(f"Error details: {traceback.format_exc()}")
+            # Includes the traceback, formatted only when the record is emitted
+            logger.exception(f"Error opening PDF: {str(e)}")
             
             return False
             
@@ -1282,8 +2029,6 @@ class LatexFileHandler(FileSystemEventHandler):
             if not (project_id and api_token):
                 logger.warning("Missing Overleaf API credentials. Cannot trigger compilation.")
                 return
-                
-            import requests
             
             # Overleaf API endpoints - try multiple endpoints
             api_endpoints = [
@@ -1309,12 +2054,22 @@ class LatexFileHandler(FileSystemEventHandler):
             logger.info(f"Using Project ID: {project_id}")
             logger.info("Triggering Overleaf compilation...")
             
-            # Try each endpoint until one works
+            # Race all endpoints and take the first one that accepts the request
             success = False
-            for endpoint in api_endpoints:
-                try:
+            executor = ThreadPoolExecutor(max_workers=len(api_endpoints))
+            try:
+                futures = {}
+                for endpoint in api_endpoints:
                     logger.info(f"Attempting compilation with endpoint: {endpoint}")
-                    response = requests.post(endpoint, headers=headers, json=data, timeout=10)
+                    futures[executor.submit(_SESSION.post, endpoint, headers=headers, json=data, timeout=10)] = endpoint
+                
+                for future in as_completed(futures):
+                    endpoint = futures[future]
+                    try:
+                        response = future.result()
+                    except requests.RequestException as e:
+                        logger.warning(f"Request to {endpoint} failed: {str(e)}")
+                        continue
                     
                     if response.status_code == 200:
                         logger.info(f"Compilation triggered successfully with {endpoint}!")
@@ -1323,16 +2078,14 @@ class LatexFileHandler(FileSystemEventHandler):
                     else:
                         logger.warning(f"Endpoint {endpoint} failed. Status code: {response.status_code}")
                         logger.warning(f"Response: {response.text}")
-                except requests.RequestException as e:
-                    logger.warning(f"Request to {endpoint} failed: {str(e)}")
-                    continue
+            finally:
+                # Don't wait for the slower endpoints once one has succeeded
+                executor.shutdown(wait=False, cancel_futures=True)
             
             if not success:
                 logger.error("All compilation endpoints failed. Check API token and project ID.")
                 logger.info("You may need to manually trigger compilation in the Overleaf interface.")
                 
-        except ImportError:
-            logger.error("Requests library not installed. Install with 'pip install requests'")
         except Exception as e:
             logger.error(f"Error triggering compilation: {str(e)}")
 
@@ -1344,96 +2097,14 @@ class LatexFileHandler(FileSystemEventHandler):
         Args:
             check_interval: Time in seconds between remote checks
         """
-        import threading
-        
+        def run_git(command):
+            return subprocess.run(command, check=True, capture_output=True, text=True,
+                                  cwd=self.git_repo_path).stdout
+
         def remote_checker():
             logger.info(f"Starting remote change monitoring (checking every {check_interval} seconds)...")
             send_log(f"Starting remote change monitoring (checking every {check_interval} seconds)...", level=0)
-            while True:
-                if os.environ.get('LATEX_COLAB_AGENT_STREAMING', False) == 'True':
-                    continue
-
-                try:
-                    # Change to git repo directory
-                    original_dir = os.getcwd()
-                    os.chdir(self.git_repo_path)
-                    
-                    # Fetch the latest changes without merging
-                    logger.debug("Fetching remote changes...")
-                    subprocess.run(["git", "fetch", "origin"], check=True, capture_output=True)
-                    
-                    # Check if there are changes to pull
-                    result = subprocess.run(
-                        ["git", "rev-list", "HEAD..origin/master", "--count"],
-                        check=True,
-                        capture_output=True,
-                        text=True
-                    )
-                    
-                    # If there are commits to pull
-                    if int(result.stdout.strip()) > 0:
-                        logger.info(f"Detected {result.stdout.strip()} new commit(s) on Overleaf")
-                        send_log(f"Detected {result.stdout.strip()} new commit(s) on Overleaf", level=0)
-                        
-                        # Check if there are uncommitted local changes
-                        status_result = subprocess.run(
-                            ["git", "status", "--porcelain"],
-                            check=True,
-                            capture_output=True,
-                            text=True
-                        )
-                        
-                        if status_result.stdout.strip():
-                            # There are local changes - stash them
-                            logger.info("Local uncommitted changes found. Stashing before pull.")
-                            send_log("Local uncommitted changes found. Stashing before pull.", level=0)
-                            subprocess.run(["git", "stash"], check=True, capture_output=True)
-                            had_local_changes = True
-                        else:
-                            had_local_changes = False
-                        
-                        # Pull the changes
-                        logger.info("Pulling changes from Overleaf...")
-                        send_log("Pulling changes from Overleaf...", level=0)
-                        pull_result = subprocess.run(
-                            ["git", "pull", "origin", "master"],
-                            check=True,
-                            capture_output=True,
-                            text=True
-                        )
-                        logger.info("Changes pulled successfully")
-                        send_log("Changes pulled successfully", level=0)
-                        
-                        # If we stashed local changes, try to apply them back
-                        if had_local_changes:
-                            try:
-                                logger.info("Applying stashed local changes...")
-                                send_log("Applying stashed local changes...", level=0)
-                                subprocess.run(["git", "stash", "pop"], check=True, capture_output=True)
-                                logger.info("Local changes reapplied")
-                                send_log("Local changes reapplied", level=0)
-                            except subprocess.CalledProcessError:
-                                logger.warning("Conflict detected when applying local changes")
-                                logger.warning("Please resolve conflicts manually in the repository")
-                                send_box("Conflict detected when applying local changes. Please resolve conflicts manually in the repository", level=0)
-                        
-                        # Update the local file with changes from git repo
-                        self.update_local_file()
-                    
-                    # Return to original directory
-                    os.chdir(original_dir)
-                    
-                except Exception as e:
-                    logger.error(f"Error checking for remote changes: {str(e)}")
-                    send_box(f"Error checking for remote changes: {str(e)}. Check for and remove .git/index.lock", level=0)
-                    # Make sure we're back in the original directory
-                    try:
-                        os.chdir(original_dir)
-                    except:
-                        pass
-                
-                # Wait for the next check
-                time.sleep(check_interval)
+            self._remote_checker(check_interval, run_git, subprocess.CalledProcessError)
         
         # Start the remote checker in a background thread
         checker_thread = threading.Thread(target=remote_checker, daemon=True)
@@ -1453,7 +2124,7 @@ class LatexFileHandler(FileSystemEventHandler):
         def remote_checker():
             logger.info(f"Starting remote change monitoring using GitPython (checking every {check_interval} seconds)...")
             
-            # Initialize the repo object
+            # Initialize the repo object once; every poll reuses it
             try:
                 repo = git.Repo(self.git_repo_path)
             except git.InvalidGitRepositoryError:
@@ -1463,162 +2134,207 @@ class LatexFileHandler(FileSystemEventHandler):
                 logger.error(f"Error opening git repository: {str(e)}")
                 return
             
-            while True:
-                if os.environ.get('LATEX_COLAB_AGENT_STREAMING', False) == 'True':
-                    continue
-                    
-                try:
-                    # Store original directory
-                    original_dir = os.getcwd()
-                    os.chdir(self.git_repo_path)
-                    
-                    # Get origin remote
-                    origin = repo.remotes.origin
-                    
-                    # Fetch latest changes
-                    logger.debug("Fetching remote changes...")
-                    origin.fetch()
-                    
-                    # Get the local and remote references
-                    local_head = repo.heads.master  # Or 'main' depending on branch name
-                    remote_head = repo.refs['origin/master']  # Or 'origin/main'
+            self._remote_checker(check_interval, repo.git.execute, git.GitCommandError)
+        
+        # Start the remote checker in a background thread
+        checker_thread = threading.Thread(target=remote_checker, daemon=True)
+        checker_thread.start()
+        
+        return checker_thread
+
+    def _remote_checker(self, check_interval, run_git, git_error):
+        """
+        Poll Overleaf and merge new remote commits, shared by both monitor backends
+        run_git takes a full git command list and returns its stdout; failures raise git_error
+        """
+        schedule = AdaptivePollSchedule(check_interval)
+        while True:
+            # Don't pull while the agent is streaming edits; check again next interval
+            if self._wait_while_streaming(check_interval):
+                continue
+
+            try:
+                # Ask for the remote head only; fetch objects only when it moved
+                ls_output = run_git(["git", "ls-remote", "origin", "refs/heads/master"])
+                remote_sha = ls_output.split()[0] if ls_output.strip() else None
+                # Nothing moved since the last fully handled check: skip the local git work too
+                if remote_sha is None or remote_sha != self._last_remote_sha:
+                    try:
+                        tracking_sha = run_git(["git", "rev-parse", "--verify", "--quiet", PREFETCH_REF]).strip()
+                    except git_error:
+                        tracking_sha = None
+                    if remote_sha != tracking_sha:
+                        # Fetch the latest changes without merging
+                        logger.debug("Fetching remote changes...")
+                        run_git(PREFETCH_COMMAND)
                     
-                    # Check if remote is ahead of local
-                    commits_behind = sum(1 for c in repo.iter_commits(f"{local_head}..{remote_head}"))
+                    # Check if there are changes to pull (counted by git)
+                    commits_behind = int(run_git(["git", "rev-list", "--count", f"HEAD..{PREFETCH_REF}"]).strip())
                     
                     if commits_behind > 0:
-                        logger.info(f"Detected {commits_behind} new commit(s) on Overleaf")
+                        logger.info("Detected %d new commit(s) on Overleaf", commits_behind)
+                        schedule.record_change()
+                        send_log(f"Detected {commits_behind} new commit(s) on Overleaf", level=0)
                         
-                        # Check for local changes
-                        if repo.is_dirty(untracked_files=True):
+                        # Check for local changes with one git status. Untracked files are not
+                        # stashed by git stash, so they must not trigger a stash/pop
+                        if run_git(["git", "status", "--porcelain=v2", "-z", "--untracked-files=no"]):
+                            # There are local changes - stash them
                             logger.info("Local uncommitted changes found. Stashing before pull.")
-                            # Create a stash
-                            repo.git.stash('save', f"Auto-stash before pull at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+                            send_log("Local uncommitted changes found. Stashing before pull.", level=0)
+                            run_git(["git", "stash", "push", "-m", time.strftime(STASH_MESSAGE_FORMAT)])
                             had_local_changes = True
                         else:
                             had_local_changes = False
                         
-                        # Pull changes
+                        # Pull the changes
                         logger.info("Pulling changes from Overleaf...")
-                        try:
-                            pull_info = origin.pull()
-                            logger.info(f"Changes pulled successfully: {pull_info[0].note}")
-                            
-                            # Pop the stash if we had local changes
-                            if had_local_changes:
-                                try:
-                                    logger.info("Applying stashed local changes...")
-                                    repo.git.stash('pop')
-                                    logger.info("Local changes reapplied")
-                                except git.GitCommandError as e:
-                                    if "conflict" in str(e).lower():
-                                        logger.warning("Conflict detected when applying local changes")
-                                        logger.warning("Please resolve conflicts manually in the repository")
-                                    else:
-                                        logger.error(f"Error applying stashed changes: {str(e)}")
-                            
-                            # Update the local file with changes from git repo
-                            self.update_local_file()
-                        except git.GitCommandError as e:
-                            logger.error(f"Git pull failed: {str(e)}")
-                    
-                    # Return to original directory
-                    os.chdir(original_dir)
-                    
-                except Exception as e:
-                    logger.error(f"Error checking for remote changes: {str(e)}")
-                    import traceback
-                    logger.debug(f"Traceback: {traceback.format_exc()}")
+                        send_log("Pulling changes from Overleaf...", level=0)
+                        # A failed merge raises to the handler below and is retried next poll
+                        merge_output = run_git(MERGE_PREFETCH_COMMAND)
+                        run_git(UPDATE_TRACKING_COMMAND)
+                        logger.info("Changes pulled successfully: %s", merge_output.partition("\n")[0])
+                        send_log("Changes pulled successfully", level=0)
+                        
+                        # If we stashed local changes, try to apply them back
+                        if had_local_changes:
+                            try:
+                                logger.info("Applying stashed local changes...")
+                                send_log("Applying stashed local changes...", level=0)
+                                run_git(["git", "stash", "pop"])
+                                logger.info("Local changes reapplied")
+                                send_log("Local changes reapplied", level=0)
+                            except git_error as e:
+                                if "conflict" in f"{e} {getattr(e, 'stderr', '')}".lower():
+                                    logger.warning("Conflict detected when applying local changes")
+                                    logger.warning("Please resolve conflicts manually in the repository")
+                                    send_box("Conflict detected when applying local changes. Please resolve conflicts manually in the repository", level=0)
+                                else:
+                                    logger.error("Error applying stashed changes: %s", e)
+                                    send_box(f"Error applying stashed changes: {str(e)}", title="Error", level=0)
+                        
+                        # Update the local file with changes from git repo
+                        self.update_local_file()
                     
-                    # Make sure we're back in the original directory
-                    try:
-                        os.chdir(original_dir)
-                    except:
-                        pass
+                    self._last_remote_sha = remote_sha
                 
-                # Wait for the next check
-                time.sleep(check_interval)
-        
-        # Start the remote checker in a background thread
-        checker_thread = threading.Thread(target=remote_checker, daemon=True)
-        checker_thread.start()
-        
-        return checker_thread
+            except Exception as e:
+                logger.error("Error checking for remote changes: %s", e)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Traceback:", exc_info=True)
+                send_box(f"Error checking for remote changes: {str(e)}. Check for and remove .git/index.lock", level=0)
+            
+            # Wait for the next check, sooner when a remote commit is likely
+            time.sleep(schedule.next_delay())
     
+    def _wait_while_streaming(self, timeout):
+        """Block up to timeout while the agent is streaming; returns whether it was streaming"""
+        if sync_flags.agent_streaming.is_set():
+            # Woken early when streaming ends
+            sync_flags.agent_idle.wait(timeout=timeout)
+            return True
+        return False
+
     @staticmethod
-    def write_with_lock(filepath, content, max_attempts=5, retry_delay=1):
+    @contextlib.contextmanager
+    def file_lock(filepath, timeout=1.0):
+        """
+        Hold an exclusive lock on <filepath>.lock for the duration of the block
+        Retries with quadratic backoff plus jitter (1, 4, 9, 16 ... ms) until
+        timeout seconds have passed, so a briefly held lock costs milliseconds
+        """
         filepath = Path(filepath)
         lock_path = filepath.with_suffix(filepath.suffix + ".lock")
         
+        deadline = time.monotonic() + timeout
         attempt = 0
-        while attempt < max_attempts:
+        while True:
             lock_file = open(lock_path, 'w')
             try:
                 try:
                     fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    # Lock acquired, write the file
-                    with open(filepath, 'w') as f:
-                        f.write(content)
-                        f.flush()
-                        os.fsync(f.fileno())
-                    return  # Successfully wrote the file
                 except BlockingIOError:
                     # Lock couldn't be acquired
                     attempt += 1
-                    if attempt >= max_attempts:
-                        raise TimeoutError(f"Could not acquire lock for {filepath} after {max_attempts} attempts")
-                    print(f"Lock already held, retrying in {retry_delay} seconds (attempt {attempt}/{max_attempts})")
-                    time.sleep(retry_delay)
+                    delay = attempt * attempt * 0.001 + random.uniform(0, 0.002)
+                    if time.monotonic() + delay > deadline:
+                        raise TimeoutError(f"Could not acquire lock for {filepath} after {attempt} attempts")
+                    logger.debug(f"Lock already held, retrying in {delay * 1000:.0f} ms (attempt {attempt})")
+                    time.sleep(delay)
+                    continue
+                # Lock acquired, run the block
+                yield
+                return
             finally:
                 try:
                     fcntl.flock(lock_file, fcntl.LOCK_UN)
                 except:
                     pass  # Ignore errors when releasing a lock we might not have
+                # The lock file is left in place: removing it would let the next writer lock a fresh
+                # inode while another writer still holds the flock on the old one
                 lock_file.close()
-                if os.path.exists(lock_path):
-                    try:
-                        os.remove(lock_path)
-                    except:
-                        pass  # Ignore errors when removing the lock file
 
+    @classmethod
+    def write_with_lock(cls, filepath, content, timeout=1.0):
+        """Write content to filepath while holding an exclusive lock on <filepath>.lock"""
+        with cls.file_lock(filepath, timeout):
+            with open(filepath, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @classmethod
+    def copy_with_lock(cls, src, filepath, timeout=1.0):
+        """
+        Copy src over filepath while holding an exclusive lock on <filepath>.lock
+        The copy stays in the kernel (sendfile) and rewrites filepath in place, so
+        watchers keep seeing a modification of the same file rather than a rename
+        """
+        with cls.file_lock(filepath, timeout):
+            shutil.copyfile(src, filepath)
 
-    def update_local_file(self):
-        """Update the local file with content from the git repository"""
-        try:
-            file_name = os.path.basename(self.file_path)
-            repo_file_path = os.path.join(self.git_repo_path, file_name)
-            
-            # If the repository file exists, copy it to the local path
-            if os.path.exists(repo_file_path):
-                # Read content from repo file
-                with open(repo_file_path, 'r', encoding='utf-8') as repo_file:
-                    content = repo_file.read()
 
-                self.write_with_lock(self.file_path, content) if content else None
+    def _repo_relpath(self, path):
+        """Path of a tracked file inside the git repository, relative to its root"""
+        return os.path.relpath(path, os.path.dirname(self.file_path))
+
+    def update_local_file(self):
+        """Update the local files with content from the git repository"""
+        updated = False
+        for path in sorted(self.file_paths):
+            try:
+                file_name = self._repo_relpath(path)
+                repo_file_path = os.path.join(self.git_repo_path, file_name)
                 
-                #if len(content) > 100:
-                    # Write to local file
-                #with open(self.file_path, 'w', encoding='utf-8') as local_file:
-                #    local_file.write(content)
-                    
-                os.environ['LATEX_PULLED'] = 'True'
-                logger.info(f"Updated local file {self.file_path} with changes from Overleaf")
-                send_box(f"Updated local file {self.file_path} with changes from Overleaf", title="Updated", level=1)
+                # If the repository file exists, copy it to the local path
+                repo_stat = _try_stat(repo_file_path)
+                if repo_stat is None:
+                    logger.warning(f"File {file_name} not found in repository, cannot update local file")
+                    send_box(f"File {file_name} not found in repository, cannot update local file", title="Error", level=1)
+                    continue
                 
-                # Trigger local compilation if enabled
-                if hasattr(self, 'local_compilation') and self.local_compilation:
-                    try:
-                        logger.info("Triggering local compilation after remote update...")
-                        self.compile_locally()
-                    except Exception as e:
-                        logger.error(f"Local compilation after update failed: {str(e)}")
-            else:
-                logger.warning(f"File {file_name} not found in repository, cannot update local file")
-                send_box(f"File {file_name} not found in repository, cannot update local file", title="Error", level=1)
+                # An empty repo file is skipped rather than wiping the local copy
+                if repo_stat.st_size:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    self.copy_with_lock(repo_file_path, path)
+                updated = True
+                logger.info(f"Updated local file {path} with changes from Overleaf")
+                send_box(f"Updated local file {path} with changes from Overleaf", title="Updated", level=1)
                 
-        except Exception as e:
-            logger.error(f"Error updating local file: {str(e)}")
-            send_box(f"Error updating local file: {str(e)}", title="Error", level=1)
+            except Exception as e:
+                logger.error(f"Error updating local file {path}: {str(e)}")
+                send_box(f"Error updating local file {path}: {str(e)}", title="Error", level=1)
+        
+        if updated:
+            sync_flags.latex_pulled.set()
+            
+            # Trigger local compilation if enabled
+            if hasattr(self, 'local_compilation') and self.local_compilation:
+                try:
+                    logger.info("Triggering local compilation after remote update...")
+                    self.compile_locally()
+                except Exception as e:
+                    logger.error(f"Local compilation after update failed: {str(e)}")
 
     def monitor_remote(self):
         """Determine if remote monitoring should be enabled"""
@@ -1632,15 +2348,14 @@ class LatexFileHandler(FileSystemEventHandler):
         """
         try:
             logger.info("Pulling latest changes from Overleaf...")
-            original_dir = os.getcwd()
-            os.chdir(self.git_repo_path)
             
             # Fetch latest changes
             fetch_result = subprocess.run(
-                ["git", "fetch", "origin"],
+                PREFETCH_COMMAND,
                 check=False,
                 capture_output=True,
-                text=True
+                text=True,
+                cwd=self.git_repo_path
             )
             
             if fetch_result.returncode != 0:
@@ -1649,62 +2364,83 @@ class LatexFileHandler(FileSystemEventHandler):
                 if "Authentication failed" in fetch_result.stderr or "could not read Username" in fetch_result.stderr:
                     self.refresh_git_credentials()
                     fetch_result = subprocess.run(
-                        ["git", "fetch", "origin"],
+                        PREFETCH_COMMAND,
                         check=False,
                         capture_output=True,
-                        text=True
+                        text=True,
+                        cwd=self.git_repo_path
                     )
                     if fetch_result.returncode != 0:
-                        os.chdir(original_dir)
                         return False
             
             # Check if there are new changes
             result = subprocess.run(
-                ["git", "rev-list", "HEAD..origin/master", "--count"],
+                ["git", "rev-list", f"HEAD..{PREFETCH_REF}", "--count"],
                 check=False,
                 capture_output=True,
-                text=True
+                text=True,
+                cwd=self.git_repo_path
             )
             
             if result.returncode != 0:
                 logger.warning(f"Failed to check for new commits: {result.stderr}")
-                os.chdir(original_dir)
                 return False
             
             # If there are no changes, return early
             if int(result.stdout.strip()) == 0:
                 logger.info("No new changes on Overleaf.")
-                os.chdir(original_dir)
                 return True
             
             # There are changes to pull - implement the pulling logic
             pull_success = self.pull_and_update_changes()
             
-            os.chdir(original_dir)
             return pull_success
         
         except Exception as e:
             logger.error(f"Error pulling remote changes: {str(e)}")
-            try:
-                os.chdir(original_dir)
-            except:
-                pass
             return False
 
 
+def ensure_git_config(key, value, *scope, cwd=None):
+    """
+    Set a git config value only if the effective value differs, sparing a git write on repeat runs
+    """
+    current = subprocess.run(["git", "config", *scope, "--get", key], capture_output=True, text=True, cwd=cwd)
+    if current.stdout.strip() != value:
+        subprocess.run(["git", "config", *scope, key, value], check=True, cwd=cwd)
+
+
+def store_git_credentials(host, username, password, path="~/.git-credentials"):
+    """
+    Add an https entry for host to the git credential-store file, replacing older ones for the same user
+    """
+    cred_path = Path(path).expanduser()
+    prefix = f"https://{quote(username, safe='')}:"
+    suffix = f"@{host}"
+    entry = f"{prefix}{quote(password, safe='')}{suffix}"
+
+    try:
+        lines = cred_path.read_text().splitlines()
+    except FileNotFoundError:
+        lines = []
+    kept = [line for line in lines if not (line.startswith(prefix) and line.endswith(suffix))]
+
+    # Same permissions git credential-store uses, the file holds plain-text passwords
+    fd = os.open(cred_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(kept + [entry]) + "\n")
+
+
 def setup_overleaf_git(overleaf_git_url, local_path, git_username=None, git_password=None):
     """
     Setup the git repository if it doesn't exist
     """
+    # Parse the URL once; it is reused for the credential URL and the credential host
+    parsed_url = urlparse(overleaf_git_url)
+
     # Create a URL with embedded credentials if provided
     if git_username and git_password:
         try:
-            # Properly parse and reconstruct the URL
-            from urllib.parse import urlparse, urlunparse
-            
-            # Parse the URL
-            parsed_url = urlparse(overleaf_git_url)
-            
             # Create a new URL with credentials
             netloc = f"{git_username}:{git_password}@{parsed_url.netloc}"
             
@@ -1728,23 +2464,15 @@ def setup_overleaf_git(overleaf_git_url, local_path, git_username=None, git_pass
     # Configure Git credential helper to store credentials permanently
     try:
         # Set up credential helper globally
-        subprocess.run(["git", "config", "--global", "credential.helper", "store"], check=True)
+        ensure_git_config("credential.helper", "store", "--global")
         
         # If credentials provided, store them now using git credential approve
         if git_username and git_password:
             # Extract the host from URL for credential setup
-            from urllib.parse import urlparse
-            parsed_url = urlparse(overleaf_git_url)
             host = parsed_url.netloc
             
-            # Create git credential input
-            cred_input = f"url=https://{host}\nusername={git_username}\npassword={git_password}\n"
-            
-            # Call git credential approve to store credentials
-            process = subprocess.Popen(["git", "credential", "approve"], 
-                                      stdin=subprocess.PIPE,
-                                      universal_newlines=True)
-            process.communicate(input=cred_input)
+            # Write the entry the store helper reads, without a git credential approve round trip
+            store_git_credentials(host, git_username, git_password)
             logger.info("Stored Git credentials in credential helper")
     except Exception as e:
         logger.error(f"Error setting up git credential helper: {str(e)}")
@@ -1765,33 +2493,32 @@ def setup_overleaf_git(overleaf_git_url, local_path, git_username=None, git_pass
             logger.info("Repository cloned successfully with credential helper")
         
         # Configure repo to use stored credentials
-        os.chdir(local_path)
-        subprocess.run(["git", "config", "credential.helper", "store"], check=True)
+        ensure_git_config("credential.helper", "store", cwd=local_path)
     else:
         logger.info(f"Repository already exists at {local_path}")
         
-        # Ensure it's up to date
-        os.chdir(local_path)
-        
         # Set credential helper for this repo
-        subprocess.run(["git", "config", "credential.helper", "store"], check=True)
+        ensure_git_config("credential.helper", "store", cwd=local_path)
             
         # Try to pull - credentials should be handled by credential helper now
         try:
-            subprocess.run(["git", "pull"], check=True)
+            subprocess.run(["git", "pull"], check=True, cwd=local_path)
             logger.info("Repository updated to latest version")
         except subprocess.CalledProcessError as e:
             logger.error(f"Error pulling latest changes: {str(e)}")
             if git_username and git_password:
                 # If credentials provided, update remote URL and try again
-                subprocess.run(["git", "remote", "set-url", "origin", credential_url], check=True)
-                subprocess.run(["git", "pull"], check=True)
+                subprocess.run(["git", "remote", "set-url", "origin", credential_url], check=True, cwd=local_path)
+                subprocess.run(["git", "pull"], check=True, cwd=local_path)
                 logger.info("Repository updated after credential update")
 
 
 def main():
     parser = argparse.ArgumentParser(description='Real-time LaTeX sync with Overleaf via Git')
     parser.add_argument('file_path', help='Path to the LaTeX file to monitor')
+    parser.add_argument('--extra-files', nargs='+', default=[],
+                        help='Other project files to sync (e.g. chapters), relative to the current directory; '
+                             'they must be inside the main file\'s directory')
     parser.add_argument('--git-url', required=True, help='Overleaf Git repository URL')
     parser.add_argument('--repo-path', default='./overleaf_repo', help='Local path for the git repository')
     
@@ -1814,7 +2541,14 @@ def main():
                         help='Open the PDF after compilation (when using local-compile)')
     parser.add_argument('--auto-install-packages', action='store_true',
                         help='Automatically install missing LaTeX packages')
-    
+    parser.add_argument('--preamble-format', action='store_true',
+                        help='Precompile the document preamble into a pdflatex format (needs mylatexformat; '
+                             'not suited to preambles that open write streams, e.g. \\makeindex)')
+
+    # File watching options
+    parser.add_argument('--watch-interval', type=int, default=30,
+                        help='Polling interval in seconds when the file is on a network filesystem')
+
     args = parser.parse_args()
     
     # Handle password prompt if requested
@@ -1838,7 +2572,7 @@ def main():
     setup_overleaf_git(args.git_url, args.repo_path, args.git_username, args.git_password)
     
     # Create event handler and observer
-    event_handler = LatexFileHandler(args.file_path, args.repo_path)
+    event_handler = LatexFileHandler(args.file_path, args.repo_path, extra_files=args.extra_files)
     
     # Add API info if provided
     if args.project_id and args.api_token:
@@ -1852,25 +2586,23 @@ def main():
         event_handler.local_compilation = {
             'enabled': True,
             'open_pdf': args.open_pdf,
-            'auto_install_packages': args.auto_install_packages
+            'auto_install_packages': args.auto_install_packages,
+            'preamble_format': args.preamble_format
         }
         logger.info("Local LaTeX compilation enabled")
         
         if args.auto_install_packages:
             logger.info("Automatic package installation enabled")
     
-    observer = Observer()
+    # Watch only the target file (inotify), or its directory when we have to fall back
+    observer = create_file_watcher(event_handler, args.file_path, watch_interval=args.watch_interval)
 
     # In the main function, after creating the observer
     if event_handler.monitor_remote():
         remote_thread = event_handler.monitor_remote_changes(check_interval=10)  # Check every x seconds
         logger.info("Bidirectional synchronization enabled - monitoring for remote changes")
         send_log("Bidirectional synchronization enabled - monitoring for remote changes", level=0)
-    
-    # Schedule the observer to watch the directory containing the file
-    watch_dir = os.path.dirname(os.path.abspath(args.file_path))
-    observer.schedule(event_handler, watch_dir, recursive=False)
-    
+
     # Start the observer
     observer.start()
     logger.info(f"Monitoring {args.file_path} for changes. Press Ctrl+C to stop.")
@@ -2,9 +2,35 @@ import requests
 import json
 import time
 import random
+import queue
+import threading
+import atexit
+
+# One pooled keep-alive connection to the logger server instead of a new socket per message
+_SESSION = requests.Session()
+_SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Messages are posted by a background worker so callers only pay for an enqueue
+_QUEUE = queue.Queue()
+
+def _post_worker():
+    """Post queued messages to the server in order."""
+    while True:
+        data = _QUEUE.get()
+        try:
+            _SESSION.post('http://127.0.0.1:8000/submit', json=data, timeout=5)
+        except requests.exceptions.RequestException as e:
+            print(f"Error sending {data['command']}: {e}")
+        finally:
+            _QUEUE.task_done()
+
+threading.Thread(target=_post_worker, daemon=True).start()
+
+# Deliver whatever is still queued before the interpreter exits
+atexit.register(_QUEUE.join)
 
 def send_log(message, level=0, sender_id="client"):
-    """Send a log message to the server."""
+    """Queue a log message for the server."""
     data = {
         'id': sender_id,
         'command': 'log',
@@ -12,15 +38,11 @@ def send_log(message, level=0, sender_id="client"):
         'args': message
     }
     
-    try:
-        response = requests.post('http://127.0.0.1:8000/submit', json=data)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending log: {e}")
-        return False
+    _QUEUE.put(data)
+    return True
 
 def send_box(content, title="Information", level=0, sender_id="client"):
-    """Send a box to the server."""
+    """Queue a box for the server."""
     data = {
         'id': sender_id,
         'command': 'box',
@@ -29,17 +51,15 @@ def send_box(content, title="Information", level=0, sender_id="client"):
         'title': title
     }
     
-    try:
-        response = requests.post('http://127.0.0.1:8000/submit', json=data)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending box: {e}")
-        return False
+    _QUEUE.put(data)
+    return True
 
 def shutdown_server():
     """Send a request to shutdown the server."""
+    # Let queued messages reach the server before it goes away
+    _QUEUE.join()
     try:
-        response = requests.post('http://127.0.0.1:8000/shutdown')
+        response = _SESSION.post('http://127.0.0.1:8000/shutdown')
         return response.status_code == 200
     except requests.exceptions.RequestException as e:
         print(f"Error shutting down server: {e}")
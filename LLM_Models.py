@@ -1,6 +1,8 @@
 # Openrouter/replicate models
 
-models = [
+from functools import lru_cache
+
+models = (
     "google/gemini-2.0-flash-thinking-exp:free",
     "google/gemini-2.0-flash-exp:free",
     "google/gemini-2.0-flash-001",
@@ -41,7 +43,13 @@ models = [
     "mistralai/codestral-2501",
     "microsoft/phi-4",
     #"deepseek/deepseek-chat"
-]
+)
+
+# Lower-cased once, in the same order, so hints keep resolving to the first match
+_lowered_models = tuple((m.lower(), m) for m in models)
 
-name_hint = lambda name: [m for m in models if name in m.lower()][0]
+@lru_cache(maxsize=None)
+def name_hint(name):
+    """First model whose lower-cased id contains name"""
+    return [m for lowered, m in _lowered_models if name in lowered][0]
 
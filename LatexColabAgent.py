@@ -10,14 +10,27 @@ from LLM_Models import models, name_hint
 from textwrap import dedent
 
 from PickLatexPrompts import LaTeXEnvTracker
+import sync_flags
 
 import time
-from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import logging
-import subprocess
+import shutil
+import signal
+import queue
+import threading
 import argparse
+import git
+
+try:
+    import httpx
+except ImportError:  # Only used to tune the OpenAI client's connection pool
+    httpx = None
+try:
+    import h2  # Needed by httpx for HTTP/2
+except ImportError:
+    h2 = None
 
 from Client_example import send_box, send_log, shutdown_server
 
@@ -26,6 +39,89 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+# ssh reusing one master connection per remote; git pushes over SSH skip the handshake after the first
+SSH_MULTIPLEX_COMMAND = "ssh -o ControlMaster=auto -o ControlPath=~/.ssh/cm-%C -o ControlPersist=10m"
+
+
+def openrouter_http_client():
+    """
+    HTTP client for the OpenRouter API: keep-alive pool, HTTP/2 when h2 is installed, and the
+    OpenAI client's default 600 s timeout with a short connect timeout. None falls back to the default client.
+    """
+    if httpx is None:
+        return None
+    return httpx.Client(
+        http2=h2 is not None,
+        limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+    )
+
+
+def status_timestamp():
+    """Local time as YYYYmmdd_HHMMSS_microseconds, from a single time_ns() call"""
+    seconds, nanoseconds = divmod(time.time_ns(), 1_000_000_000)
+    return time.strftime("%Y%m%d_%H%M%S", time.localtime(seconds)) + f"_{nanoseconds // 1000:06d}"
+
+
+def character_generator(query):
+    """Fake token stream for trying out tracker.stream without calling a model"""
+    text = f"{time.time()}: Answering {query}. this is being streamed now....."
+    for t in text:
+        time.sleep(0.1)
+        yield t
+
+
+def coalesce(tokens, ms=40):
+    """
+    Join streamed tokens into chunks so each file write carries several tokens. Text waits at
+    most about ms milliseconds, even when the model pauses mid-stream: tokens are read on a
+    helper thread and the buffer is flushed once its deadline passes. The first token is passed
+    through at once to keep time-to-first-token.
+    """
+    interval = ms / 1000
+    received = queue.SimpleQueue()
+
+    def pump():
+        # Items are (token, None), then (None, None) at the end or (None, exception) on failure
+        try:
+            for token in tokens:
+                received.put((token, None))
+        except Exception as e:
+            received.put((None, e))
+        else:
+            received.put((None, None))
+
+    # Started on first iteration, so a generator created early does not read its source ahead of time
+    threading.Thread(target=pump, daemon=True).start()
+
+    first = True
+    buf = []
+    deadline = None
+    while True:
+        try:
+            token, error = received.get(timeout=max(0.0, deadline - time.perf_counter()) if buf else None)
+        except queue.Empty:  # Deadline passed with no new token
+            yield ''.join(buf)
+            buf.clear()
+            continue
+        if token is None:
+            break
+        if first:
+            first = False
+            yield token
+            continue
+        if not buf:
+            deadline = time.perf_counter() + interval
+        buf.append(token)
+        if time.perf_counter() >= deadline:
+            yield ''.join(buf)
+            buf.clear()
+    if buf:
+        yield ''.join(buf)
+    if error is not None:
+        raise error
+
+
 class Agent:
 
     def __init__(
@@ -64,11 +160,20 @@ class Agent:
         """
 
         self.latexfile = latexfile
-        self.git_repo_path = git_repo_path
+        self.git_repo_path = Path(git_repo_path) if git_repo_path else None
+        self._index_lock = self.git_repo_path / ".git" / "index.lock" if self.git_repo_path else None
+        self._repo = None  # GitPython handle on git_repo_path, opened on the first push
+        self._push_env = {}  # Extra environment for git push, see _ssh_multiplex_env
+        # Pushes run on a background worker so streaming never waits on git
+        self._push_q = queue.Queue()
+        self._push_pending = threading.Event()  # A push is queued and has not started yet
+        self._snapshot_lock = threading.Lock()  # Orders copies into the repo against staging them
+        threading.Thread(target=self._push_loop, daemon=True).start()
         self.tracker = LaTeXEnvTracker(latexfile)
         self.client = OpenAI(
                 base_url="https://openrouter.ai/api/v1",
                 api_key=OPENROUTER_API_KEY,
+                http_client=openrouter_http_client(),
                 )
         self.last_modified = time.time()
         self.cooldown = 2
@@ -85,13 +190,21 @@ class Agent:
             using begin{document} and end{document}.
         """)
         
+        watched_path = os.path.abspath(latexfile)
+
         class Handler(FileSystemEventHandler):
+            def dispatch(self_, event):
+                # The directory is watched (so editors that save by rename keep being seen);
+                # only events for the LaTeX file itself are handled
+                if event.src_path == watched_path or getattr(event, 'dest_path', None) == watched_path:
+                    super().dispatch(event)
+
             def on_modified(self_, event):
                 if self.streaming:
                     return
                 if (not event.is_directory and time.time() - self.last_modified > self.cooldown) \
-                    or os.environ['LATEX_PULLED'] == 'True':
-                    os.environ['LATEX_PULLED'] = 'False'
+                    or sync_flags.latex_pulled.is_set():
+                    sync_flags.latex_pulled.clear()
                     self.trigger()
             
             def on_created(self_, event):
@@ -107,69 +220,108 @@ class Agent:
         
         handler = Handler()
         self.observer = Observer()
-        self.observer.schedule(handler, latexfile, recursive=True)
+        self.observer.schedule(handler, os.path.dirname(watched_path), recursive=False)
         self.observer.start()
 
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            self.observer.stop()
+        # Block on the observer thread instead of waking every second; Ctrl+C stops it
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, lambda signum, frame: self.observer.stop())
         self.observer.join()
 
 
     def git_push(self):
-
+        """
+        Copy the file into the git repo now and queue its commit and push for the background worker.
+        A push that is still waiting in the queue already picks up this copy, so none is added.
+        """
         if not self.git_repo_path:
             return
         
-        os.environ['GIT_PUSH_DISABLED'] = 'True'
-        
         # Copy the modified file to the git repository
         file_name = os.path.basename(self.latexfile)
         dest_path = os.path.join(self.git_repo_path, file_name)
     
-        with open(self.latexfile, 'r', encoding='utf-8') as source_file:
-            content = source_file.read()
-        
-        with open(dest_path, 'w', encoding='utf-8') as dest_file:
-            dest_file.write(content)
-
-        # Git operations - move to git repo directory first
-        os.chdir(self.git_repo_path)
-        original_dir = os.getcwd()
-        
-        # Add and commit the file
+        # Byte copy in the kernel (sendfile on Linux); shutil falls back to a buffered copy where unsupported
+        with self._snapshot_lock:
+            shutil.copyfile(self.latexfile, dest_path)
+
+        if not self._push_pending.is_set():
+            self._push_pending.set()
+            self._push_q.put(file_name)
+
+    def _push_loop(self):
+        while True:
+            file_name = self._push_q.get()
+            self._push_pending.clear()
+            try:
+                self._commit_and_push(file_name)
+            except Exception as e:
+                # Keep the only push worker alive; otherwise later pushes queue up and trigger() blocks on join()
+                logger.error(f"Push of {file_name} failed: {str(e)}")
+                send_log(message=f"Push of {file_name} failed: {str(e)}", level=0)
+            finally:
+                self._push_q.task_done()
+
+    def _commit_and_push(self, file_name):
+        sync_flags.git_push_disabled.set()
+
+        # Stage and commit through repo.git, which runs git with cwd set per call. GitPython's
+        # index.add would os.chdir the whole process while other threads write relative paths.
         try:
-            subprocess.run(["git", "add", file_name], check=True)
-            subprocess.run(["git", "commit", "-m", f"Auto-update: {file_name}"], check=True)
-            
-            # Push to Overleaf
-            logger.info("Pushing changes to Overleaf...")
-            send_log(message="Pushing changes to Overleaf...", level=0)
-            result = subprocess.run(["git", "push", "origin", "master"], 
-                                check=True, 
-                                capture_output=True, 
-                                text=True)
-            
-            logger.info("Successfully pushed changes to Overleaf!")
-            send_log(message="Successfully pushed changes to Overleaf!", level=0)
-        except subprocess.CalledProcessError as e:
+            if self._repo is None:
+                repo = git.Repo(self.git_repo_path)
+                self._push_env = self._ssh_multiplex_env(repo.remotes.origin.url)
+                self._repo = repo
+            with self._snapshot_lock:
+                self._repo.git.add(file_name)
+            # Same outcome as a failing `git commit` with nothing staged: no commit, no push
+            status, _, _ = self._repo.git.diff("--cached", "--quiet", with_exceptions=False, with_extended_output=True)
+            unchanged = status == 0
+
+            if unchanged:
+                logger.info("No changes to commit")
+                send_log(message="No changes to commit", level=0)
+            else:
+                self._repo.git.commit("-m", f"Auto-update: {file_name}")
+
+                # Push to Overleaf
+                logger.info("Pushing changes to Overleaf...")
+                send_log(message="Pushing changes to Overleaf...", level=0)
+                with self._repo.git.custom_environment(**self._push_env):
+                    self._repo.git.push("origin", "master")
+
+                logger.info("Successfully pushed changes to Overleaf!")
+                send_log(message="Successfully pushed changes to Overleaf!", level=0)
+        except (git.GitError, ValueError, OSError) as e:
             logger.error(f"Git operation failed: {e.stderr if hasattr(e, 'stderr') else str(e)}")
             send_log(message=f"Git operation failed: {e.stderr if hasattr(e, 'stderr') else str(e)}", level=0)
         finally:
-            # Return to original directory
-            os.chdir(original_dir)
+            sync_flags.git_push_disabled.clear()
 
-        os.environ['GIT_PUSH_DISABLED'] = 'False'
 
+    @staticmethod
+    def _ssh_multiplex_env(remote_url):
+        """
+        Environment for pushes to an SSH remote: share one connection across pushes with an
+        ssh ControlMaster kept open for 10 minutes. Empty for HTTPS remotes or a user GIT_SSH_COMMAND.
+        """
+        is_ssh = remote_url.startswith("ssh://") or ("://" not in remote_url and ":" in remote_url)
+        if not is_ssh or os.environ.get("GIT_SSH_COMMAND"):
+            return {}
+        os.makedirs(os.path.expanduser("~/.ssh"), mode=0o700, exist_ok=True)
+        return {"GIT_SSH_COMMAND": SSH_MULTIPLEX_COMMAND}
 
     def think(self, query, params={}):
+        """
+        Send the request now and return a generator over the reasoning tokens. The model
+        starts working while the caller does other things (e.g. git_push) before reading.
+        """
         model = params.get("model", self.default_model)
         logger.info(f"Calling model: {model}")
         send_box(content=f"{params}", title=f"Calling", level=1)
+        model = name_hint(model)
         self.completion = self.client.chat.completions.create(
-                model=name_hint(model),
+                model=model,
                 messages=[
                     {"role": "system",
                      "content": self.system},
@@ -184,7 +336,9 @@ class Agent:
                 #reasoning_effort="high",
                 stream=True
                 )
-        
+        return self._reasoning_tokens()
+
+    def _reasoning_tokens(self):
         for token in self.completion:
             if hasattr(token.choices[0].delta, 'reasoning') and (the_token := token.choices[0].delta.reasoning):
                 yield the_token
@@ -211,12 +365,6 @@ class Agent:
         #self.last_modified = time.time()
         #self.tracker.save(self.latexfile)
 
-        def character_generator(query):
-            text = f"{time.time()}: Answering {query}. this is being streamed now....."
-            for t in text:
-                time.sleep(0.1)
-                yield t
-
         if self.differences:
             self.last_modified = time.time()
             env = self.differences[0]
@@ -230,56 +378,52 @@ class Agent:
 
             if env_type == "user" and env_text and status in ["start"]:
                 self.streaming = True
-                os.environ['LATEX_COLAB_AGENT_STREAMING']='True'
+                sync_flags.set_agent_streaming(True)
                 self.tracker.commit(self.latexfile)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                timestamp = status_timestamp()
                 env_params["status"] = f'Reasoning_{timestamp}'
-                updated_text = env_text + "\n%parameters: " + \
-                    ', '.join([f"{key}={value}" for key,value in env_params.items()])
+                updated_text = env_text + "\n%parameters: " + self.tracker.format_params(env_params)
                 self.tracker.update_env(env, updated_text)
                 self.tracker.save(self.latexfile)
                 
+                # Request first so the model's prefill overlaps with pushing the status marker
+                reasoning = self.think(query=env_text, params=env_params)
                 self.git_push()
 
+                # Reasoning, then the answer, streamed in one pass
                 self.tracker.commit(self.latexfile)
                 self.tracker.stream(
                     new_env={
                         "before":{env_type: env_text},
-                        "after": {"reasoning": self.think(query=env_text, params=env_params)},
-                        "title": f"by {model}"
-                    },
-                    output_file=self.latexfile
-                )
-
-                self.tracker.commit(self.latexfile)
-                self.tracker.stream(
-                    new_env={
-                        "before":{env_type: env_text},
-                        "after": {"answer": self.answer()},
+                        "after": [("reasoning", coalesce(reasoning)), ("answer", coalesce(self.answer()))],
                         "title": f"by {model}"
                     },
                     output_file=self.latexfile
                 )
 
                 self.tracker.commit(self.latexfile)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                timestamp = status_timestamp()
                 env_params["status"] = f'completed_{timestamp}'
-                updated_text = env_text + "\n%parameters: " + \
-                    ', '.join([f"{key}={value}" for key,value in env_params.items()])
+                updated_text = env_text + "\n%parameters: " + self.tracker.format_params(env_params)
                 self.tracker.update_env(env, updated_text)
                 self.tracker.save(self.latexfile)
                 self.tracker.commit(self.latexfile)
 
-                # Check if index.lock exists in the git repo and remove it
-                index_lock = Path(self.git_repo_path / ".git/index.lock")
-                if index_lock.exists():
-                    logger.info("Git may have crushed. Removing index.lock.")
-                    send_box("Git may have crushed. Removing index.lock.", title="Reviving git", level=1)
-                    index_lock.unlink(missing_ok=True) 
+                # Remove a stale index.lock left in the git repo (one unlink, no separate exists check).
+                # Wait for queued pushes first so a lock held by our own worker is never removed
+                self._push_q.join()
+                if self._index_lock is not None:
+                    try:
+                        self._index_lock.unlink()
+                    except FileNotFoundError:
+                        pass
+                    else:
+                        logger.info("Git may have crushed. Removing index.lock.")
+                        send_box("Git may have crushed. Removing index.lock.", title="Reviving git", level=1)
 
                 self.git_push()
                 self.streaming = False
-                os.environ['LATEX_COLAB_AGENT_STREAMING']='False'
+                sync_flags.set_agent_streaming(False)
 
 
 
@@ -295,8 +439,9 @@ if __name__ == '__main__':
     # source = Path("~/PythonDev/LatexColab/latex_samples/colab_test/local/main.tex").expanduser()
     # git_repo = Path("~/PythonDev/LatexColab/latex_samples/colab_test/67c5d8972683f1ee5d2c2dc0/").expanduser()
 
-    source = Path(args.file_path).expanduser()
-    git_repo = Path(args.repo_path).expanduser()
+    # Absolute paths, so nothing depends on the working directory once the worker threads run
+    source = Path(args.file_path).expanduser().absolute()
+    git_repo = Path(args.repo_path).expanduser().absolute()
 
     if not source.exists(): # or not git_repo.exists():
         print("Latex source could not be found.")
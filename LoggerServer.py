@@ -2,16 +2,63 @@
 
 import http.server
 import socketserver
+import base64
+import binascii
+import hashlib
 import json
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
+from operator import itemgetter
 import threading
 import time
 from urllib.parse import urlparse, parse_qs
 import os
+import socket
+import queue
 import webbrowser
+import zlib
 import tempfile
 import subprocess
 import sys
 
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+
+def _dumps(obj):
+    """Serialize obj to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _loads(data):
+    """Parse JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+_seq_of = itemgetter('seq')
+_FLUSH_INTERVAL = 0.02  # Seconds the flusher waits to batch up entries
+
+
+def _entries_after(entries, seq):
+    """Return the entries with a sequence number above seq."""
+    # Entries are appended in sequence order, so the deque can be bisected
+    return list(islice(entries, bisect_left(entries, seq + 1, key=_seq_of), None))
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server handling each request in its own daemon thread"""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
 class WebLoggerServer:
     """
     A server for tracking logging messages and other information.
@@ -20,17 +67,25 @@ class WebLoggerServer:
     - Right panel (30%): For other information (level 1)
     """
     
-    def __init__(self, port=8000):
-        """Initialize the server with the given port."""
+    def __init__(self, port=8000, max_logs=10_000, max_info=1_000):
+        """Initialize the server with the given port and panel capacities."""
         self.port = port
         self.server = None
-        self.logs = []  # Store logs
-        self.info = []  # Store information
+        self.logs = deque(maxlen=max_logs)  # Store the latest logs
+        self.info = deque(maxlen=max_info)  # Store the latest information
+        self.backgrounds = {}  # Latest GIF background entry per level, kept out of the capped panels
+        self.assets = {}  # Content hash -> (bytes, MIME type) of the current background images
+        self._lock = threading.Lock()  # Guards logs, info, backgrounds, assets and _seq across threads
+        self._cond = threading.Condition(self._lock)  # Wakes /updates streams on new entries
+        self._seq = 0  # Sequence number of the latest entry in logs or info
+        self._inbox = queue.SimpleQueue()  # Entries waiting for the flusher thread
         self.server_thread = None
+        self.flusher_thread = None
         self.running = False
-        self.html_template = self._generate_html_template()
+        self.html_template = _HTML_BYTES
         
-    def _generate_html_template(self):
+    @staticmethod
+    def _generate_html_template():
         """Generate the HTML template for the web interface."""
         return """
         <!DOCTYPE html>
@@ -170,9 +225,6 @@ class WebLoggerServer:
             </div>
             
             <script>
-                // Generate a random client ID to track updates
-                const clientId = 'client_' + Math.random().toString(36).substring(2, 15);
-                
                 // Function to add log entry
                 function addLog(text) {
                     const logContainer = document.getElementById('logs');
@@ -180,7 +232,6 @@ class WebLoggerServer:
                     logEntry.className = 'log-entry';
                     logEntry.textContent = text;
                     logContainer.appendChild(logEntry);
-                    scrollIfNeeded(logContainer);
                 }
                 
                 // Function to add a box
@@ -202,7 +253,6 @@ class WebLoggerServer:
                     box.appendChild(boxContent);
                     
                     container.appendChild(box);
-                    scrollIfNeeded(container);
                 }
                 
                 // Auto-scroll if checkbox is checked
@@ -239,32 +289,32 @@ class WebLoggerServer:
                     }
                 }
                 
-                // Fetch updates every second
-                setInterval(async function() {
-                    try {
-                        // Send client ID in header to track updates per client
-                        const response = await fetch('/updates', {
-                            headers: {
-                                'X-Client-ID': clientId
-                            }
-                        });
-                        const data = await response.json();
-                        
-                        if (data.updates && data.updates.length > 0) {
-                            for (const update of data.updates) {
-                                if (update.command === 'log') {
-                                    addLog(update.args);
-                                } else if (update.command === 'box') {
-                                    addBox(update.args, update.title || 'Info', update.level);
-                                } else if (update.command === 'gif') {
-                                    setBackgroundGif(update.args, update.level, update.transparency);
-                                }
-                            }
+                // Apply the updates received since the last frame, then scroll once
+                let pendingUpdates = [];
+                function flushUpdates() {
+                    const batch = pendingUpdates;
+                    pendingUpdates = [];
+                    for (const update of batch) {
+                        if (update.command === 'log') {
+                            addLog(update.args);
+                        } else if (update.command === 'box') {
+                            addBox(update.args, update.title || 'Info', update.level);
+                        } else if (update.command === 'gif') {
+                            setBackgroundGif(update.args, update.level, update.transparency);
                         }
-                    } catch (error) {
-                        console.error('Error fetching updates:', error);
                     }
-                }, 1000);
+                    scrollIfNeeded(document.getElementById('logs'));
+                    scrollIfNeeded(document.getElementById('info'));
+                }
+                
+                // Receive updates pushed by the server as they arrive
+                const updates = new EventSource('/updates');
+                updates.onmessage = function(event) {
+                    if (pendingUpdates.length === 0) {
+                        requestAnimationFrame(flushUpdates);
+                    }
+                    pendingUpdates.push(JSON.parse(event.data));
+                };
             </script>
         </body>
         </html>
@@ -273,62 +323,123 @@ class WebLoggerServer:
     class RequestHandler(http.server.SimpleHTTPRequestHandler):
         """Handle HTTP requests to the server."""
         
+        # Keep connections open between requests; every response must then carry Content-Length
+        protocol_version = 'HTTP/1.1'
+        
         def __init__(self, *args, **kwargs):
             self.server_instance = kwargs.pop('server_instance')
             super().__init__(*args, **kwargs)
         
+        def setup(self):
+            """Disable Nagle's algorithm so small responses go out immediately."""
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        def _send_json(self, status, response):
+            """Send a JSON response with the given status code."""
+            body = _dumps(response)
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def _send_not_found(self, close=False):
+            """Send an empty 404 response, optionally closing the connection after it."""
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            if close:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+        
         def do_GET(self):
             """Handle GET requests."""
             path = urlparse(self.path).path
             
             if path == '/':
                 # Serve the main HTML page
+                # The page only changes with this module, so let the browser revalidate by ETag
+                if self.headers.get('If-None-Match') == _HTML_ETAG:
+                    self.send_response(304)
+                    self.send_header('ETag', _HTML_ETAG)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
                 self.send_response(200)
-                self.send_header('Content-type', 'text/html')
+                self.send_header('Content-type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(self.server_instance.html_template)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('ETag', _HTML_ETAG)
                 self.end_headers()
-                self.wfile.write(self.server_instance.html_template.encode())
+                self.wfile.write(self.server_instance.html_template)
             elif path == '/updates':
-                # Get client identifier to track updates per client
-                client_id = self.headers.get('X-Client-ID', self.client_address[0])
-                
-                # Ensure we have a tracking dictionary for clients
-                if not hasattr(self.server_instance, 'client_indices'):
-                    self.server_instance.client_indices = {}
-                
-                # Initialize this client's tracking indices if needed
-                if client_id not in self.server_instance.client_indices:
-                    self.server_instance.client_indices[client_id] = {
-                        'log_index': 0,
-                        'info_index': 0
-                    }
-                
-                # Return new logs and info as JSON
+                self._stream_updates()
+            elif path.startswith('/asset/'):
+                with self.server_instance._lock:
+                    asset = self.server_instance.assets.get(path[len('/asset/'):])
+                if asset is None:
+                    self._send_not_found()
+                    return
+                body, mime = asset
                 self.send_response(200)
-                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-type', mime)
+                self.send_header('Content-Length', str(len(body)))
+                # Assets are named by their content hash, so they never change
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
                 self.end_headers()
-                
-                updates = []
-                
-                # Get new logs since last request for this client
-                client_data = self.server_instance.client_indices[client_id]
-                log_index = client_data['log_index']
-                if log_index < len(self.server_instance.logs):
-                    for log in self.server_instance.logs[log_index:]:
-                        updates.append(log)
-                    client_data['log_index'] = len(self.server_instance.logs)
-                
-                # Get new info since last request for this client
-                info_index = client_data['info_index']
-                if info_index < len(self.server_instance.info):
-                    for info in self.server_instance.info[info_index:]:
-                        updates.append(info)
-                    client_data['info_index'] = len(self.server_instance.info)
-                
-                response = {'updates': updates}
-                self.wfile.write(json.dumps(response).encode())
+                self.wfile.write(body)
             else:
-                self.send_response(404)
-                self.end_headers()
+                self._send_not_found()
+        
+        def _stream_updates(self):
+            """Push new logs and info to the client as server-sent events."""
+            server = self.server_instance
+            # Resume after the last sequence number the client saw: a reconnecting EventSource
+            # reports it as Last-Event-ID, other clients can pass ?since=N
+            since = self.headers.get('Last-Event-ID') or parse_qs(urlparse(self.path).query).get('since', ['0'])[0]
+            try:
+                since = int(since)
+            except ValueError:
+                since = 0
+            
+            # The stream has no length, so it ends by closing the connection
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.send_header('Vary', 'Accept-Encoding')
+            # One gzip stream for the whole connection, so repeated keys compress against earlier frames
+            compressor = None
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                compressor = zlib.compressobj(1, zlib.DEFLATED, 31)  # wbits=31 selects the gzip format
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            
+            with server._cond:
+                if since > server._seq:  # Cursor from before a server restart, start over
+                    since = 0
+            
+            try:
+                while server.running:
+                    with server._cond:
+                        server._cond.wait_for(lambda: not server.running or server._seq > since, timeout=25)
+                        updates = [gif for gif in server.backgrounds.values() if gif['seq'] > since]
+                        updates += _entries_after(server.logs, since)
+                        updates += _entries_after(server.info, since)
+                        since = server._seq
+                    
+                    if updates:
+                        frames = b''.join(b'data: ' + _dumps(update) + b'\n\n' for update in updates)
+                        frames += f'id: {since}\n\n'.encode()
+                    else:
+                        frames = b': keep-alive\n\n'  # Comment frame, lets us notice closed tabs
+                    if compressor is not None:
+                        frames = compressor.compress(frames) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                    self.wfile.write(frames)
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
         
         def do_POST(self):
             """Handle POST requests."""
@@ -337,10 +448,10 @@ class WebLoggerServer:
             if path == '/submit':
                 # Read the request body
                 content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length).decode('utf-8')
+                post_data = self.rfile.read(content_length)
                 
                 try:
-                    data = json.loads(post_data)
+                    data = _loads(post_data)
                     sender_id = data.get('id', 'unknown')
                     command = data.get('command')
                     level = data.get('level', 0)
@@ -354,10 +465,7 @@ class WebLoggerServer:
                             'args': args
                         }
                         
-                        if level == 0:
-                            self.server_instance.logs.append(log_entry)
-                        else:
-                            self.server_instance.info.append(log_entry)
+                        self.server_instance._append(log_entry)
                     
                     elif command == 'box':
                         box_entry = {
@@ -368,10 +476,7 @@ class WebLoggerServer:
                             'title': data.get('title', 'Information')
                         }
                         
-                        if level == 0:
-                            self.server_instance.logs.append(box_entry)
-                        else:
-                            self.server_instance.info.append(box_entry)
+                        self.server_instance._append(box_entry)
                     
                     elif command == 'gif':
                         gif_entry = {
@@ -382,40 +487,24 @@ class WebLoggerServer:
                             'transparency': data.get('transparency', 0.3)
                         }
                         
-                        if level == 0:
-                            self.server_instance.logs.append(gif_entry)
-                        else:
-                            self.server_instance.info.append(gif_entry)
+                        self.server_instance._append(gif_entry)
                     
                     # Send a success response
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    response = {'status': 'success'}
-                    self.wfile.write(json.dumps(response).encode())
+                    self._send_json(200, {'status': 'success'})
                 
-                except json.JSONDecodeError:
+                except ValueError:  # Invalid JSON or UTF-8
                     # Send an error response
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    response = {'status': 'error', 'message': 'Invalid JSON'}
-                    self.wfile.write(json.dumps(response).encode())
+                    self._send_json(400, {'status': 'error', 'message': 'Invalid JSON'})
             
             elif path == '/shutdown':
                 # Shutdown the server
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {'status': 'success', 'message': 'Server shutting down'}
-                self.wfile.write(json.dumps(response).encode())
+                self._send_json(200, {'status': 'success', 'message': 'Server shutting down'})
                 
                 # Schedule server shutdown after response is sent
                 threading.Thread(target=self.server_instance.stop).start()
             
             else:
-                self.send_response(404)
-                self.end_headers()
+                self._send_not_found(close=True)  # Any request body was left unread
 
     @staticmethod
     def open_chrome_with_size(url, width=800, height=600):
@@ -479,7 +568,7 @@ class WebLoggerServer:
 
         # Create server with custom request handler
         handler = lambda *args, **kwargs: self.RequestHandler(*args, server_instance=self, **kwargs)
-        self.server = socketserver.TCPServer(('127.0.0.1', self.port), handler)
+        self.server = _ThreadingServer(('127.0.0.1', self.port), handler)
         self.running = True
         
         print(f"Server started at http://127.0.0.1:{self.port}")
@@ -488,6 +577,8 @@ class WebLoggerServer:
         self.server_thread = threading.Thread(target=self.server.serve_forever)
         self.server_thread.daemon = True
         self.server_thread.start()
+        self.flusher_thread = threading.Thread(target=self._flusher, daemon=True)
+        self.flusher_thread.start()
         
         # Open browser if requested
         if open_browser:
@@ -501,13 +592,77 @@ class WebLoggerServer:
             return
         
         print("Shutting down server...")
+        self._inbox.put(None)
+        self.flusher_thread.join()
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()  # Release the open /updates streams
         self.server.shutdown()
         self.server.server_close()
-        self.running = False
         sys.stdout = self.original_stdout
         sys.stderr = self.original_stderr
         print("Server stopped")
     
+    def _append(self, entry):
+        """Queue an entry for the logs (level 0) or info (other levels) panel."""
+        self._inbox.put(entry)
+
+    def _flusher(self):
+        """Move queued entries into the panels in batches until a None sentinel arrives."""
+        while True:
+            batch = [self._inbox.get()]
+            time.sleep(_FLUSH_INTERVAL)  # Let a burst of entries pile up
+            try:
+                while True:
+                    batch.append(self._inbox.get_nowait())
+            except queue.Empty:
+                pass
+            
+            done = None in batch
+            if done:
+                batch = batch[:batch.index(None)]
+            # Swap data URLs for /asset/ URLs here, so every asset is stored by this thread
+            for entry in batch:
+                if entry['command'] == 'gif':
+                    entry['args'] = self._store_asset(entry['args'])
+            with self._cond:
+                for entry in batch:
+                    self._seq += 1
+                    entry['seq'] = self._seq
+                    if entry['command'] == 'gif':
+                        # Only the current background matters, and it must survive old entries being dropped
+                        self.backgrounds[entry['level']] = entry
+                    elif entry['level'] == 0:
+                        self.logs.append(entry)
+                    else:
+                        self.info.append(entry)
+                # Drop the images of replaced backgrounds; clients that showed them have fetched them already
+                current = {gif['args'] for gif in self.backgrounds.values()}
+                for key in [key for key in self.assets if f'/asset/{key}' not in current]:
+                    del self.assets[key]
+                self._cond.notify_all()
+            if done:
+                return
+
+    def _store_asset(self, url):
+        """Keep a base64 data URL's content server-side and return a short /asset/ URL for it.
+        
+        Other URLs are returned unchanged.
+        """
+        if not (isinstance(url, str) and url.startswith('data:image/')):
+            return url
+        header, _, encoded = url.partition(',')
+        if not header.endswith(';base64'):
+            return url
+        try:
+            body = base64.b64decode(encoded, validate=True)
+        except binascii.Error:
+            return url
+        key = hashlib.sha1(body).hexdigest()[:16]
+        with self._lock:
+            self.assets[key] = (body, header[len('data:'):-len(';base64')])
+        return f'/asset/{key}'
+
     def add_gif_background(self, gif_url, level=0, transparency=0.3, sender_id='system'):
         """Add an animated GIF background to a window level.
         
@@ -525,10 +680,7 @@ class WebLoggerServer:
             'transparency': transparency
         }
         
-        if level == 0:
-            self.logs.append(gif_entry)
-        else:
-            self.info.append(gif_entry)
+        self._append(gif_entry)
     
     def add_log(self, text, level=0, sender_id='system'):
         """Add a log entry programmatically."""
@@ -539,10 +691,7 @@ class WebLoggerServer:
             'args': text
         }
         
-        if level == 0:
-            self.logs.append(log_entry)
-        else:
-            self.info.append(log_entry)
+        self._append(log_entry)
     
     def add_box(self, text, title="Information", level=0, sender_id='system'):
         """Add a box entry programmatically."""
@@ -554,15 +703,15 @@ class WebLoggerServer:
             'title': title
         }
         
-        if level == 0:
-            self.logs.append(box_entry)
-        else:
-            self.info.append(box_entry)
+        self._append(box_entry)
+
+# The page is static, so it is built and encoded once per process
+_HTML_BYTES = WebLoggerServer._generate_html_template().encode('utf-8')
+_HTML_ETAG = '"%s"' % hashlib.sha1(_HTML_BYTES).hexdigest()[:16]
+
 
 # Example usage
 if __name__ == "__main__":
-    import base64
-
     def gif_to_base64_data_url(gif_path):
         """Convert a GIF file to a Base64 data URL."""
         with open(gif_path, "rb") as gif_file:
@@ -54,7 +54,7 @@ import re
 import os
 import fcntl
 import time
-from typing import List, Dict, Any, Union, Optional, Iterator, Iterable
+from typing import List, Dict, Any, Optional, Iterable
 from datetime import datetime
 from pathlib import Path
 
@@ -78,14 +78,63 @@ class LaTeXEnvTracker:
         self.recent_reasoning_time = 0.0
         
         # Read the current version
-        with open(current_version_file, 'r', encoding='utf-8') as f:
-            self.current_content = f.read()
+        self.current_content = self._read(current_version_file)
         
         # Initialize new_content as current_content initially
         self.new_content = self.current_content
         
         # Parse environments in the current version
         self.current_envs = self._parse_environments(self.current_content)
+
+        # (path, mtime_ns, size) of the last file this tracker wrote, see commit()
+        self._saved_signature = None
+    
+    @staticmethod
+    def _read(file_path: str) -> str:
+        """
+        Read a LaTeX file as text with one read() and one decode of the whole file.
+        
+        Args:
+            file_path (str): Path to the file
+            
+        Returns:
+            str: File content, with newlines translated as in text-mode open()
+        """
+        with open(file_path, 'rb') as f:
+            text = f.read().decode('utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    @staticmethod
+    def _file_signature(file_path: str) -> Optional[tuple]:
+        """
+        Identify a file version by its path, modification time and size.
+        
+        Args:
+            file_path (str): Path to the file
+            
+        Returns:
+            Optional[tuple]: (absolute path, mtime in ns, size), or None if the file cannot be stat'ed
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+    
+    @staticmethod
+    def format_params(params: Dict[str, Any]) -> str:
+        """
+        Format parameters the way _parse_parameters reads them back.
+        
+        Args:
+            params (Dict[str, Any]): Parameter key-value pairs
+            
+        Returns:
+            str: Comma separated key=value pairs
+        """
+        return ', '.join(f"{key}={value}" for key, value in params.items())
     
     def _parse_parameters(self, text: str) -> Dict[str, str]:
         """
@@ -169,9 +218,16 @@ class LaTeXEnvTracker:
         """
         self.new_version_file = new_version_file
         
+        # The file is still exactly what save()/stream() last wrote: reuse the in-memory
+        # version instead of reading and parsing it again
+        signature = self._file_signature(new_version_file)
+        if signature is not None and signature == self._saved_signature:
+            self.new_content = self.current_content
+            self.new_envs = [dict(env) for env in self.current_envs]
+            return
+        
         # Read the new version
-        with open(new_version_file, 'r', encoding='utf-8') as f:
-            self.new_content = f.read()
+        self.new_content = self._read(new_version_file)
         
         # Parse environments in the new version
         self.new_envs = self._parse_environments(self.new_content)
@@ -191,6 +247,19 @@ class LaTeXEnvTracker:
                 env1["text"] == env2["text"] and 
                 env1["params"] == env2["params"])
     
+    @staticmethod
+    def _env_key(env: Dict[str, Any]) -> tuple:
+        """
+        Hashable identity of an environment, ignoring position (see _env_equals).
+        
+        Args:
+            env (Dict[str, Any]): Environment dictionary
+            
+        Returns:
+            tuple: (type, text, parameters)
+        """
+        return (env["type"], env["text"], frozenset(env["params"].items()))
+    
     def _env_in_list(self, env: Dict[str, Any], env_list: List[Dict[str, Any]]) -> bool:
         """
         Check if an environment is in a list of environments.
@@ -220,9 +289,13 @@ class LaTeXEnvTracker:
         
         new_envs = []
         
+        # Same equality as _env_equals, as a set built once: one lookup per environment
+        # instead of a scan of the current version for each of them
+        current_keys = {self._env_key(env) for env in self.current_envs}
+        
         for env in self.new_envs:
             # Check if this environment exists in the current version
-            if not self._env_in_list(env, self.current_envs):
+            if self._env_key(env) not in current_keys:
                 # Add to the list of new environments (exclude position information)
                 new_envs.append({
                     "type": env["type"],
@@ -418,12 +491,9 @@ class LaTeXEnvTracker:
                     fcntl.flock(lock_file, fcntl.LOCK_UN)
                 except:
                     pass  # Ignore errors when releasing a lock we might not have
+                # The lock file is left in place: removing it would let the next writer lock a fresh
+                # inode while another writer still holds the flock on the old one
                 lock_file.close()
-                if os.path.exists(lock_path):
-                    try:
-                        os.remove(lock_path)
-                    except:
-                        pass  # Ignore errors when removing the lock file
 
     
     def save(self, file_path: str) -> None:
@@ -441,24 +511,28 @@ class LaTeXEnvTracker:
         #    f.write(self.new_content)
 
         self.write_with_lock(file_path, self.new_content)
+        self._saved_signature = self._file_signature(file_path)
         
-        # Update the current version information
+        # Update the current version information. push()/update_env() only shift positions,
+        # so parse the saved text to match what a commit() of the file would see
         self.current_version_file = file_path
         self.current_content = self.new_content
-        self.current_envs = self.new_envs
+        self.current_envs = self._parse_environments(self.new_content)
         
         # Reset the new version
         self.new_version_file = None
         self.new_envs = []
         
-    def stream(self, new_env: Dict[str, Dict[str, Union[str, Iterator[str]]]], output_file: str) -> None:
+    def stream(self, new_env: Dict[str, Any], output_file: str) -> None:
         """
         Stream content into a new environment and save it to a file in real-time.
         The file is updated incrementally, showing all existing content plus the
         streaming content as it's generated.
         
         Args:
-            new_env (Dict): Dictionary with 'before' and 'after' keys, where 'after' contains an iterator
+            new_env (Dict): Dictionary with 'before' and 'after' keys, where 'after' maps an environment
+                type to an iterator, or is a list of (type, iterator) pairs streamed one after another.
+                Each of them is inserted right after the 'before' environment, as separate stream() calls would.
             output_file (str): Path to save the updated LaTeX file
         """
         if self.new_version_file is None:
@@ -468,7 +542,6 @@ class LaTeXEnvTracker:
         before_env = new_env.get("before", {})
         after_env = new_env.get("after", {})
         etitle = new_env.get("title", None)
-        env_title = '['+etitle+']' if etitle else ''
         
         if not before_env or not after_env:
             raise ValueError("Both 'before' and 'after' environments must be provided")
@@ -477,12 +550,12 @@ class LaTeXEnvTracker:
         before_type = list(before_env.keys())[0]
         before_text = before_env[before_type]
         
-        # Extract type and iterator from the after environment
-        after_type = list(after_env.keys())[0]
-        content_iterator = after_env[after_type]
+        # Extract type and iterator pairs from the after environment
+        after_envs = after_env if isinstance(after_env, list) else [next(iter(after_env.items()))]
         
-        if not isinstance(content_iterator, Iterable):
-            raise ValueError("The 'after' value must be an iterator")
+        for _, content_iterator in after_envs:
+            if not isinstance(content_iterator, Iterable):
+                raise ValueError("The 'after' value must be an iterator")
         
         # Find the 'before' environment in the new version
         found_env = self._find_env_by_content(before_type, before_text, self.new_envs)
@@ -497,77 +570,62 @@ class LaTeXEnvTracker:
         prefix = self.new_content[:insert_pos]
         suffix = self.new_content[insert_pos:]
         
-        # First, write the complete file with a placeholder for the streamed content
-        # with open(output_file, 'w', encoding='utf-8') as f:
-        #     f.write(prefix)
-        #     f.write(f"\n\\begin{{{after_type}}}{env_title}\n")
-        #     f.write("... streaming content will appear here ...")
-        #     f.write(f"\n\\end{{{after_type}}}\n")
-        #     f.write(suffix)
+        for after_type, content_iterator in after_envs:
+            env_title = '['+etitle+']' if etitle else ''
 
-        placeholder = (
-            prefix +
-            f"\n\\begin{{{after_type}}}{env_title}\n" +
-            "... streaming content will appear here ..." +
-            f"\n\\end{{{after_type}}}\n" +
-            suffix
-        )
+            placeholder = (
+                prefix +
+                f"\n\\begin{{{after_type}}}{env_title}\n" +
+                "... streaming content will appear here ..." +
+                f"\n\\end{{{after_type}}}\n" +
+                suffix
+            )
 
-        self.write_with_lock(output_file, placeholder)
-        
-        # Now stream the content by reading, modifying, and writing back the file
-        streamed_content = ""
+            self.write_with_lock(output_file, placeholder)
+            
+            # Now stream the content, rewriting the file with everything received so far
+            streamed_content = ""
 
-        start_time = time.time()
-        
-        for chunk in content_iterator:
-            # Accumulate the streamed content
-            streamed_content += chunk
+            start_time = time.time()
             
-            # Read the current file content
-            with open(output_file, 'r', encoding='utf-8') as f:
-                current_file_content = f.read()
+            for chunk in content_iterator:
+                # Accumulate the streamed content
+                streamed_content += chunk
+                
+                # Construct the updated content with the latest streamed content
+                updated_content = (
+                    prefix + 
+                    f"\n\\begin{{{after_type}}}{env_title}\n" + 
+                    streamed_content + 
+                    f"\n\\end{{{after_type}}}\n" + 
+                    suffix
+                )
+
+                self.write_with_lock(output_file, updated_content)
             
-            # Construct the updated content with the latest streamed content
-            updated_content = (
-                prefix + 
+            # Final content with all streamed content
+            elapsed_time = time.time() - start_time + self.recent_reasoning_time
+            self.recent_reasoning_time = 0.0
+
+            minutes = int(elapsed_time // 60)
+            seconds = int(elapsed_time % 60)
+            env_title = '['+f"{etitle} (generated in {minutes} minutes and {seconds} seconds.)"+']' if etitle else ''
+            streamed_env = (
                 f"\n\\begin{{{after_type}}}{env_title}\n" + 
                 streamed_content + 
-                f"\n\\end{{{after_type}}}\n" + 
-                suffix
-            )
-            
-            # Write the updated content back to the file
-            #with open(output_file, 'w', encoding='utf-8') as f:
-            #    f.write(updated_content)
+                f"\n\\end{{{after_type}}}\n"
+            ) if streamed_content else ""
 
-            self.write_with_lock(output_file, updated_content)
-        
-        # Final content with all streamed content
-        elapsed_time = time.time() - start_time + self.recent_reasoning_time
-        self.recent_reasoning_time = 0.0
-
-        minutes = int(elapsed_time // 60)
-        seconds = int(elapsed_time % 60)
-        env_title = '['+f"{etitle} (generated in {minutes} minutes and {seconds} seconds.)"+']' if etitle else ''
-        final_content = (
-            prefix + 
-            f"\n\\begin{{{after_type}}}{env_title}\n" + 
-            streamed_content + 
-            f"\n\\end{{{after_type}}}\n" + 
-            suffix
-        ) if streamed_content else prefix+suffix
-
-        if not streamed_content and elapsed_time > 0:
-            self.recent_reasoning_time = elapsed_time
-        
-        # Save the final content
-        #with open(output_file, 'w', encoding='utf-8') as f:
-        #    f.write(final_content)
-        
-        self.write_with_lock(output_file, final_content)
+            if not streamed_content and elapsed_time > 0:
+                self.recent_reasoning_time = elapsed_time
+            
+            # Save the final content; the next environment goes in front of this one
+            suffix = streamed_env + suffix
+            self.write_with_lock(output_file, prefix + suffix)
         
         # Update the internal state
+        final_content = prefix + suffix
+        self._saved_signature = self._file_signature(output_file)
         self.new_content = final_content
         self.new_envs = self._parse_environments(final_content)
         self.current_version_file = output_file
@@ -0,0 +1,26 @@
+# Flags shared by the Overleaf sync (AgenticLatexGitPush) and the agent (LatexColabAgent)
+# when both run in one process. They replace the LATEX_PULLED, LATEX_COLAB_AGENT_STREAMING
+# and GIT_PUSH_DISABLED environment variables, which were only visible in-process as well.
+
+import threading
+
+# Set by the sync after it copied remote changes into the local file; consumed by the agent
+latex_pulled = threading.Event()
+
+# Set while the agent pushes through its own repo copy; the sync skips local changes meanwhile
+git_push_disabled = threading.Event()
+
+# Set while the agent streams into the file; the sync holds off pulling meanwhile
+agent_streaming = threading.Event()
+agent_idle = threading.Event()  # Inverse of agent_streaming, so waiters wake when streaming ends
+agent_idle.set()
+
+
+def set_agent_streaming(active):
+    """Mark the start or end of an agent streaming session"""
+    if active:
+        agent_streaming.set()
+        agent_idle.clear()
+    else:
+        agent_streaming.clear()
+        agent_idle.set()